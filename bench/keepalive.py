@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+"""
+I measure the latency of sequential small GETs on the standalone server,
+with a new connection per request (HTTP/1.0 behaviour) and with a single
+persistent HTTP/1.1 connection.
+
+Usage: PYTHONPATH=lib python bench/keepalive.py [REQUESTS]
+"""
+from httplib import HTTPConnection
+from rdflib import Graph, URIRef
+from rdfrest.http_server import HttpFrontend
+from sys import argv
+from threading import Thread
+from time import time
+from wsgiref.simple_server import make_server, WSGIRequestHandler, \
+    WSGIServer
+
+from semwiki.service import SemWikiService
+from semwiki.standalone import bind_prefixes, KeepAliveRequestHandler, \
+    ThreadingWSGIServer
+
+class Server(ThreadingWSGIServer):
+    """A loopback server, not depending on command line options"""
+    def __init__(self, server_address, handler_class):
+        WSGIServer.__init__(self, server_address, handler_class)
+
+def quiet(handler_class):
+    """Return a subclass of `handler_class` logging nothing"""
+    class QuietHandler(handler_class):
+        "Log nothing"
+        def log_message(self, *args):
+            "Log nothing"
+            pass
+    return QuietHandler
+
+def serve(handler_class):
+    """Start a server with a few topics, and return it"""
+    httpd = make_server("localhost", 0, None, Server, quiet(handler_class))
+    root_uri = URIRef("http://localhost:%s/" % httpd.server_port)
+    service = SemWikiService(root_uri, Graph().store, True)
+    service.get(URIRef(root_uri + "Home")).wikitext = \
+        "Welcome to :SemWiki :see->:Help"
+    httpd.set_app(HttpFrontend(service))
+    thread = Thread(target=httpd.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return httpd
+
+def run(port, requests, persistent):
+    """GET /Home.txt `requests` times, and return the mean latency in ms"""
+    conn = HTTPConnection("localhost", port)
+    start = time()
+    for _ in xrange(requests):
+        if not persistent:
+            conn = HTTPConnection("localhost", port)
+        conn.request("GET", "/Home.txt")
+        response = conn.getresponse()
+        response.read()
+        assert response.status == 200, response.status
+        if not persistent:
+            conn.close()
+    conn.close()
+    return (time() - start) * 1000.0 / requests
+
+def main():
+    "Run the benchmark"
+    requests = int(argv[1]) if len(argv) > 1 else 1000
+    bind_prefixes()
+    for label, handler_class, persistent in [
+        ("HTTP/1.0, one connection per request", WSGIRequestHandler, False),
+        ("HTTP/1.1, one connection per request", KeepAliveRequestHandler,
+         False),
+        ("HTTP/1.1, persistent connection", KeepAliveRequestHandler, True),
+        ]:
+        httpd = serve(handler_class)
+        run(httpd.server_port, 50, persistent) # warm up
+        latency = run(httpd.server_port, requests, persistent)
+        print "%-40s %.3f ms/request" % (label, latency)
+        httpd.shutdown()
+        httpd.server_close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+"""
+I measure the cost of editing the triples of a topic (rather than its
+wikitext) on pages with many semantic links, i.e. of reconciling the wikitext
+with the new triples.
+
+Usage: PYTHONPATH=lib python bench/reconcile.py [LINKS...]
+"""
+from rdflib import Graph, Literal, URIRef
+from rdfrest.local import unregister_service
+from sys import argv
+from time import time
+
+from semwiki.format import add_triples, ban_triples
+from semwiki.service import SemWikiService
+
+ROOT_URI = URIRef("http://localhost:8001/")
+REL = URIRef(ROOT_URI + "rel")
+VALUE = URIRef(ROOT_URI + "value")
+
+def make_topic(links):
+    """Return a topic with `links` semantic links"""
+    service = SemWikiService(ROOT_URI, Graph().store, True)
+    topic = service.get(URIRef(ROOT_URI + "Big"))
+    topic.wikitext = "\n".join(
+        "Item %s is related to :rel->:T%s and has :value->%s # note %s"
+        % (i, i, i, i) for i in xrange(links))
+    return topic
+
+def timed(func, repeat):
+    """Call `func` `repeat` times, and return the mean duration in ms"""
+    start = time()
+    for i in xrange(repeat):
+        func(i)
+    return (time() - start) * 1000.0 / repeat
+
+def run(links):
+    """Run the benchmark for a page with `links` links"""
+    topic = make_topic(links)
+    uri = topic.uri
+    wikitext = topic.wikitext
+    repeat = max(1, 20000 // links)
+
+    def ban_one(i):
+        "Ban one triple"
+        ban_triples(topic, wikitext, [(uri, REL, URIRef("%sT%s"
+                                                       % (ROOT_URI, i)))])
+    def ban_many(_):
+        "Ban 10% of the triples"
+        ban_triples(topic, wikitext, [
+            (uri, VALUE, Literal(i)) for i in xrange(0, links, 10) ])
+    def add_one(i):
+        "Add one triple"
+        add_triples(topic, wikitext, [(uri, REL, URIRef("%sNew%s"
+                                                       % (ROOT_URI, i)))])
+    def edit_one(i):
+        "Remove one triple through the RDF interface"
+        with topic.edit() as editable:
+            editable.remove((uri, REL, URIRef("%sT%s" % (ROOT_URI, i))))
+
+    results = [ timed(ban_one, repeat), timed(ban_many, max(1, repeat // 10)),
+                timed(add_one, repeat),
+                timed(edit_one, min(repeat, links, 20)) ]
+    print "%6s links: " % links + "  ".join(
+        "%s %8.3f ms" % (label, result) for label, result
+        in zip(["ban 1", "ban 10%", "add 1", "edit"], results))
+    unregister_service(topic.service)
+
+def main():
+    "Run the benchmark"
+    for links in [ int(i) for i in argv[1:] ] or [100, 1000, 5000]:
+        run(links)
+
+if __name__ == "__main__":
+    main()
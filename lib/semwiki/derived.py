@@ -0,0 +1,139 @@
+"""
+I provide the base class of the derived resources of a SemWiki.
+
+Derived resources are read-only resources computed by the service from the
+topics (rather than stored), such as indexes or reports. Their URIs are of
+the form ``<root>@name``, as the '@' prefix is reserved for special resources.
+"""
+from rdflib import URIRef
+from rdfrest.exceptions import InvalidParametersError, \
+    MethodNotAllowedError, RdfRestException
+from rdfrest.local import ILocalResource
+
+class DerivedResource(ILocalResource):
+    """A read-only resource whose state is computed by `make_state`.
+
+    Subclasses must define RDF_MAIN_TYPE and `make_state`, and may accept some
+    parameters in `get_state` by listing them in PARAMETERS.
+    """
+
+    RDF_MAIN_TYPE = None
+    PARAMETERS = ()
+    DEFAULT_LIMIT = 100
+
+    def __init__(self, uri, service):
+        # not calling ILocalResource __init__ #pylint: disable=W0231
+        self.uri = uri
+        self.service = service
+
+    def make_state(self, parameters):
+        """Return the state of this resource for the given `parameters`.
+        """
+        raise NotImplementedError
+
+    def get_limit(self, parameters):
+        """Return the value of parameter ``limit`` (or DEFAULT_LIMIT).
+
+        :raise: InvalidParametersError if it is not a positive integer
+        """
+        try:
+            limit = int(parameters.get("limit", self.DEFAULT_LIMIT))
+            if limit < 0:
+                raise ValueError(limit)
+        except ValueError:
+            raise InvalidParametersError("Invalid limit %s"
+                                         % parameters["limit"])
+        return limit
+
+    ######## IResource implementation  ########
+
+    def factory(self, uri, _rdf_type=None, _no_spawn=False):
+        """I implement :meth:`.interface.IResource.factory`.
+        """
+        return self.service.get(URIRef(uri), _rdf_type, _no_spawn)
+
+    def get_state(self, parameters=None):
+        """I implement `.interface.IResource.get_state`.
+        """
+        self.check_parameters(parameters, "get_state")
+        return self.make_state(parameters or {})
+
+    def force_state_refresh(self, parameters=None):
+        """I implement `.interface.IResource.force_state_refresh`.
+        """
+        # nothing to do, the state is computed every time
+        self.check_parameters(parameters, "force_state_refresh")
+
+    def edit(self, parameters=None, clear=False, _trust=False):
+        """I implement `.interface.IResource.edit`.
+
+        Not supported, as derived resources are read-only.
+        """
+        # unused arguments #pylint: disable=W0613
+        raise MethodNotAllowedError("%s is read-only" % self.uri)
+
+    def post_graph(self, graph, parameters=None,
+                   _trust=False, _created=None, _rdf_type=None):
+        """I implement :meth:`.interface.IResource.post_graph`.
+
+        Not supported, as derived resources are read-only.
+        """
+        # unused arguments #pylint: disable=W0613
+        raise MethodNotAllowedError("%s is read-only" % self.uri)
+
+    def delete(self, parameters=None, _trust=False):
+        """I implement :meth:`.interface.IResource.delete`.
+
+        Not supported, as derived resources are read-only.
+        """
+        # unused arguments #pylint: disable=W0613
+        raise MethodNotAllowedError("%s is read-only" % self.uri)
+
+    ######## ILocalResource implementation  ########
+
+    def check_parameters(self, parameters, method):
+        """I implement :meth:`ILocalResource.check_parameters`.
+
+        I accept the parameters listed in PARAMETERS for get_state, each with
+        a single value.
+        """
+        if parameters is not None:
+            if not parameters:
+                raise InvalidParametersError("Unsupported parameters "
+                                             "(empty dict instead of None)")
+            unsupported = [ key for key in parameters
+                            if key not in self.PARAMETERS ]
+            if method != "get_state" or unsupported:
+                raise InvalidParametersError("Unsupported parameter(s):" +
+                                             ", ".join(unsupported or
+                                                       parameters.keys()))
+            for key, value in parameters.items():
+                if isinstance(value, list):
+                    raise InvalidParametersError("Parameter %s can not be "
+                                                 "repeated" % key)
+
+    @classmethod
+    def complete_new_graph(cls, service, uri, parameters, new_graph,
+                           resource=None):
+        """I implement :meth:`ILocalResource.complete_new_graph`.
+        """
+        raise MethodNotAllowedError("%s is read-only" % uri)
+
+    @classmethod
+    def check_new_graph(cls, service, uri, parameters, new_graph,
+                        resource=None, added=None, removed=None):
+        """I implement :meth:`ILocalResource.check_new_graph`.
+        """
+        raise MethodNotAllowedError("%s is read-only" % uri)
+
+    @classmethod
+    def mint_uri(cls, target, new_graph, created, basename="o", suffix=""):
+        """I implement :meth:`rdfrest.local.ILocalResource.mint_uri`.
+        """
+        raise RdfRestException("Derived resources can not be created")
+
+    @classmethod
+    def create(cls, service, uri, new_graph):
+        """I implement :meth:`ILocalResource.create`.
+        """
+        raise RdfRestException("Derived resources can not be created")
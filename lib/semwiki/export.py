@@ -0,0 +1,243 @@
+"""
+I export a SemWiki as a static directory tree.
+
+Every topic is rendered in each of the requested formats (by default HTML,
+plain wikitext and Turtle) into a file named after the topic, so that the
+resulting tree can be served as a read-only mirror by any HTTP server.
+HTML pages link each other with relative paths, list only the exported
+formats, and contain no edit client (see `.serpar.serialize_static_html`).
+
+Rendering is distributed over a pool of processes, and is incremental: a
+manifest recording a digest of every exported topic is kept in the output
+directory, and only the topics whose state changed since the previous export
+are rendered again.
+"""
+from functools import partial
+from hashlib import md5
+from json import dump, load
+import logging
+from multiprocessing import cpu_count, Pool
+from optparse import OptionParser
+from os import makedirs, remove, rename
+from os.path import dirname, exists, join
+from rdflib import Graph, URIRef
+from rdfrest.local import unregister_service
+from rdfrest.serializers import get_serializer_by_extension
+from time import time
+
+from .hooks import HookRegistry
+from .namespace import SW, uri_key
+from .replication import apply_state, iter_topic_states
+from .serpar import serialize_static_html
+from .service import SemWikiService
+from .standalone import bind_prefixes, make_store
+
+LOG = logging.getLogger(__name__)
+
+MANIFEST = ".semwiki-export.json"
+DEFAULT_FORMATS = ("html", "txt", "ttl")
+
+def main(argv=None):
+    """I run the export-html command.
+    """
+    options = parse_options(argv)
+    logging.basicConfig(level=getattr(logging, options.log_level.upper()))
+    bind_prefixes(options.ns_prefix)
+    store, create = make_store(options.repository)
+    if create:
+        LOG.warning("repository %s is empty", options.repository)
+    service = SemWikiService(URIRef(options.uri), store, create, index=False)
+    formats = options.formats.split(",")
+    start = time()
+    stats = export_html(service, options.output, formats, options.processes,
+                        options.full, options.ns_prefix)
+    LOG.info("%(rendered)s topic(s) rendered, %(unchanged)s unchanged, "
+             "%(removed)s removed, %(failed)s failed", stats)
+    LOG.info("export completed in %.1fs", time() - start)
+
+def parse_options(argv=None):
+    """I parse the command line of the export-html command.
+    """
+    opt = OptionParser(usage="%prog export-html [options] -o OUTPUT",
+                       description="Export a SemWiki as static files")
+    opt.add_option("-o", "--output",
+                   help="the directory where files are exported (required)")
+    opt.add_option("-r", "--repository",
+                  help="the filename/identifier of the RDF database")
+    opt.add_option("-u", "--uri", default="http://localhost:8001/",
+                  help="the root URI of the SemWiki "
+                       "(default: http://localhost:8001/)")
+    opt.add_option("-f", "--formats", default=",".join(DEFAULT_FORMATS),
+                   help="a comma-separated list of file extensions "
+                        "(default: %s)" % ",".join(DEFAULT_FORMATS))
+    opt.add_option("-j", "--processes", type=int, default=cpu_count(),
+                   help="the number of rendering processes "
+                        "(default: number of CPUs)")
+    opt.add_option("--full", action="store_true", default=False,
+                   help="render all topics, even unchanged ones")
+    opt.add_option("-n", "--ns-prefix", action="append",
+                  help="a namespace prefix declaration as 'prefix:uri'")
+    opt.add_option("-l", "--log-level", default="info",
+                   choices=["debug", "info", "warning", "error", "critical"])
+    options, args = opt.parse_args(argv)
+    if args:
+        opt.error("spurious arguments")
+    if options.output is None:
+        opt.error("--output is required")
+    if not options.uri.endswith("/"):
+        options.uri += "/"
+    return options
+
+def export_html(service, output_dir, formats=DEFAULT_FORMATS, processes=None,
+                full=False, ns_prefixes=None):
+    """I export all topics of `service` into `output_dir`.
+
+    :param formats:   the file extensions of the serializers to use
+    :param processes: the number of rendering processes (defaults to the
+                      number of CPUs)
+    :param full:      if True, render all topics even if unchanged
+
+    :return: a dict with the number of 'rendered', 'unchanged', 'removed'
+             and 'failed' topics
+    """
+    formats = list(formats)
+    manifest_path = join(output_dir, MANIFEST)
+    old_digests = {}
+    if not full and exists(manifest_path):
+        with open(manifest_path) as manifest_file:
+            manifest = load(manifest_file)
+        if manifest.get("root") == unicode(service.root_uri) \
+                and manifest.get("formats") == formats:
+            old_digests = manifest["topics"]
+
+    root_uri = service.root_uri
+    digests = {}
+    jobs = []
+    for uri, state in iter_topic_states(service):
+        triples = list(state)
+        digest = topic_digest(triples)
+        key = uri_key(uri)
+        digests[key] = digest
+        if old_digests.get(key) != digest:
+            jobs.append((uri, triples))
+    unchanged = len(digests) - len(jobs)
+    failed = 0
+
+    if jobs:
+        if processes is None:
+            processes = cpu_count()
+        pool = Pool(processes, _init_worker,
+                    (service, output_dir, formats, ns_prefixes))
+        try:
+            chunksize = max(1, min(64, len(jobs) // (processes * 4)))
+            for uri, success in pool.imap_unordered(_render_topic, jobs,
+                                                    chunksize):
+                if not success:
+                    # will be retried by the next export
+                    digests[uri_key(uri)] = None
+                    failed += 1
+        finally:
+            pool.close()
+            pool.join()
+
+    removed = [ uri for uri in old_digests if uri not in digests ]
+    for uri in removed:
+        for ext in formats:
+            try:
+                path = topic_path(output_dir, root_uri, uri, ext)
+            except ValueError:
+                LOG.warning("<%s> is outside %s, not removed",
+                            uri, output_dir)
+                break
+            if exists(path):
+                remove(path)
+
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w") as manifest_file:
+        dump({"root": unicode(root_uri), "formats": formats,
+              "topics": digests},
+             manifest_file)
+    rename(tmp_path, manifest_path)
+    return {"rendered": len(jobs) - failed, "unchanged": unchanged,
+            "removed": len(removed), "failed": failed}
+
+def topic_digest(triples):
+    """Return a digest of the given triples, independant of their order.
+    """
+    lines = sorted( u" ".join(node.n3() for node in triple)
+                    for triple in triples )
+    return md5(u"\n".join(lines).encode("utf-8")).hexdigest()
+
+def topic_path(output_dir, root_uri, uri, ext):
+    """Return the path of the file where `uri` is exported with `ext`.
+    """
+    parts = uri[len(root_uri):].encode("utf-8").split("/")
+    if [ i for i in parts if i in ("", ".", "..") ]:
+        raise ValueError("Can not export <%s>" % uri)
+    return "%s.%s" % (join(output_dir, *parts), ext)
+
+
+# The following is executed in the worker processes
+
+_WORKER = {}
+
+def _init_worker(parent_service, output_dir, formats, ns_prefixes):
+    """I initialize a rendering process.
+
+    Each process has its own in-memory service, where the topic to render is
+    temporarily stored. That service has no hook, as rendering a topic is
+    not an edit, and no derived index.
+
+    `parent_service` is the service being exported, which is inherited
+    (through fork) by this process; it is unregistered, so that it does not
+    prevent the registration of our own service with the same root URI.
+    """
+    unregister_service(parent_service)
+    bind_prefixes(ns_prefixes)
+    service = SemWikiService(parent_service.root_uri, Graph().store, True,
+                             hooks=HookRegistry(), index=False)
+    serializers = []
+    for ext in formats:
+        if ext == "html":
+            # a browsable page, rather than a copy of the live one
+            serializer = partial(serialize_static_html, formats=formats)
+        else:
+            serializer, _ = get_serializer_by_extension(ext, SW.Topic)
+        if serializer is None:
+            raise ValueError("No serializer for extension %r" % ext)
+        serializers.append((ext, serializer))
+    _WORKER.update(service=service, output_dir=output_dir,
+                   serializers=serializers)
+
+def _render_topic(job):
+    """I render one topic in all the formats.
+    """
+    uri, triples = job
+    service = _WORKER["service"]
+    output_dir = _WORKER["output_dir"]
+    apply_state(service, uri, triples)
+    try:
+        topic = service.get(uri)
+        state = topic.get_state()
+        for ext, serializer in _WORKER["serializers"]:
+            path = topic_path(output_dir, service.root_uri, uri, ext)
+            directory = dirname(path)
+            if not exists(directory):
+                try:
+                    makedirs(directory)
+                except OSError:
+                    if not exists(directory): # not created by another worker
+                        raise
+            tmp_path = "%s.tmp" % path
+            with open(tmp_path, "wb") as out:
+                for chunk in serializer(state, topic):
+                    if isinstance(chunk, unicode):
+                        chunk = chunk.encode("utf-8")
+                    out.write(chunk)
+            rename(tmp_path, path)
+    except Exception: # catching Exception #pylint: disable=W0703
+        LOG.exception("could not render <%s>", uri)
+        return uri, False
+    finally:
+        apply_state(service, uri, ())
+    return uri, True
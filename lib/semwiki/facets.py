@@ -0,0 +1,359 @@
+"""
+I implement an index of the typed values of semantic links, allowing range
+and faceted queries over the topics of a SemWiki.
+
+For every predicate, the typed literals (numbers, booleans, dates and
+date-times) used as its objects are kept in sorted lists, so that the number
+of values in a given range, the distinct values in that range and their
+counts, can be computed with a binary search rather than by scanning every
+triple.
+
+NB: values are counted with multiplicity, i.e. a topic having two values in
+a range counts twice (but the count of each distinct value is a number of
+topics, as a topic can not have the same value twice).
+
+The index is kept up to date by `SemWikiService.topic_changed`, and is served
+as the ``@facets`` resource of the SemWiki.
+"""
+from bisect import bisect_left, bisect_right, insort
+from decimal import Decimal, InvalidOperation
+from rdflib import BNode, Graph, Literal, RDF, URIRef, XSD
+from rdfrest.exceptions import InvalidParametersError
+from threading import Lock
+
+from .derived import DerivedResource
+from .namespace import SW, uri_key
+
+NUMBER, BOOLEAN, DATE, DATETIME = "number", "boolean", "date", "dateTime"
+
+KINDS = {
+    XSD.integer: NUMBER,
+    XSD.decimal: NUMBER,
+    XSD.double: NUMBER,
+    XSD.float: NUMBER,
+    XSD.int: NUMBER,
+    XSD.long: NUMBER,
+    XSD.short: NUMBER,
+    XSD.nonNegativeInteger: NUMBER,
+    XSD.positiveInteger: NUMBER,
+    XSD.nonPositiveInteger: NUMBER,
+    XSD.negativeInteger: NUMBER,
+    XSD.boolean: BOOLEAN,
+    XSD.date: DATE,
+    XSD.dateTime: DATETIME,
+}
+
+class FacetIndex(object):
+    """I index the typed values of the semantic links of all topics.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._facets = {}
+        self._topics = {}
+
+    def update(self, uri, triples):
+        """Replace the values indexed for topic `uri` by those of `triples`.
+        """
+        uri = uri_key(uri)
+        new = _typed_entries(triples)
+        with self._lock:
+            for entry, count in self._topics.pop(uri, {}).iteritems():
+                for _ in xrange(count):
+                    self._remove(entry, uri)
+            entries = {}
+            for entry in new:
+                entries[entry] = entries.get(entry, 0) + 1
+                self._add(entry, uri)
+            if entries:
+                self._topics[uri] = entries
+
+    def change(self, uri, added, removed):
+        """Update the values indexed for topic `uri`, given the triples
+        `added` to and `removed` from it.
+
+        Unlike `update`, this only costs the size of the change.
+        """
+        uri = uri_key(uri)
+        new = _typed_entries(added)
+        old = _typed_entries(removed)
+        if not new and not old:
+            return
+        with self._lock:
+            entries = self._topics.get(uri, {})
+            for entry in old:
+                count = entries[entry] - 1
+                if count:
+                    entries[entry] = count
+                else:
+                    del entries[entry]
+                self._remove(entry, uri)
+            for entry in new:
+                entries[entry] = entries.get(entry, 0) + 1
+                self._add(entry, uri)
+            if entries:
+                self._topics[uri] = entries
+            else:
+                self._topics.pop(uri, None)
+
+    def get_facets(self):
+        """Return a list of (predicate, kind, count, min, max) tuples.
+
+        `count` is the number of values (see `query`).
+        """
+        with self._lock:
+            return [ (URIRef(pred), kind, len(facet.keys), facet.keys[0],
+                      facet.keys[-1])
+                     for (pred, kind), facet in self._facets.items() ]
+
+    def get_kinds(self, predicate):
+        """Return the kinds of the values indexed for `predicate`.
+        """
+        predicate = uri_key(predicate)
+        with self._lock:
+            return [ kind for pred, kind in self._facets if pred == predicate ]
+
+    def query(self, predicate, kind, low=None, high=None, limit=100):
+        """Query the values of `predicate` of the given `kind`.
+
+        :param low, high: the bounds (included) of the range of values,
+                          or None
+        :param limit:     the maximum number of values and matches returned
+
+        :return: a dict with the number of values in the range ('count',
+                 a topic having several values in the range being counted
+                 several times), the number of distinct values ('distinct'),
+                 the 'min' and 'max' value in the range, a list of (value,
+                 number of topics) pairs ('values') and a list of
+                 (topic_uri, value) pairs ('matches').
+        """
+        with self._lock:
+            facet = self._facets.get((uri_key(predicate), kind))
+            if facet is None:
+                return {"count": 0, "distinct": 0, "min": None, "max": None,
+                        "values": [], "matches": []}
+            return facet.query(low, high, limit)
+
+    def _add(self, (facet_key, key), uri):
+        """Add an entry of topic `uri`, while holding the lock."""
+        facet = self._facets.get(facet_key)
+        if facet is None:
+            facet = self._facets[facet_key] = _Facet()
+        facet.add(key, uri)
+
+    def _remove(self, (facet_key, key), uri):
+        """Remove an entry of topic `uri`, while holding the lock."""
+        facet = self._facets[facet_key]
+        facet.remove(key, uri)
+        if not facet.keys:
+            del self._facets[facet_key]
+
+def _typed_entries(triples):
+    """Return the ((predicate, kind), value) entries indexing `triples`."""
+    ret = []
+    for _, pred, obj in triples:
+        kind, key = typed_key(obj)
+        if kind is not None:
+            ret.append(((uri_key(pred), kind), key))
+    return ret
+
+
+class _Facet(object):
+    """I index the values of one kind of one predicate.
+
+    `entries` is the sorted list of (value, topic) pairs, and `keys` the list
+    of the corresponding values (used for binary searches); `values` is the
+    sorted list of distinct values, and `counts` maps them to their number of
+    occurrences.
+    """
+    #pylint: disable-msg=R0903
+    #    too few public methods
+
+    __slots__ = ["entries", "keys", "values", "counts"]
+
+    def __init__(self):
+        self.entries = []
+        self.keys = []
+        self.values = []
+        self.counts = {}
+
+    def add(self, key, uri):
+        """Add value `key` for topic `uri`."""
+        entry = (key, uri)
+        i = bisect_right(self.entries, entry)
+        self.entries.insert(i, entry)
+        self.keys.insert(i, key)
+        count = self.counts.get(key, 0)
+        if not count:
+            insort(self.values, key)
+        self.counts[key] = count + 1
+
+    def remove(self, key, uri):
+        """Remove value `key` for topic `uri`."""
+        i = bisect_left(self.entries, (key, uri))
+        del self.entries[i]
+        del self.keys[i]
+        count = self.counts[key] - 1
+        if count:
+            self.counts[key] = count
+        else:
+            del self.counts[key]
+            del self.values[bisect_left(self.values, key)]
+
+    def query(self, low, high, limit):
+        """Implement `FacetIndex.query`."""
+        keys = self.keys
+        values = self.values
+        i, j = 0, len(keys)
+        if low is not None:
+            i = bisect_left(keys, low)
+        if high is not None:
+            j = bisect_right(keys, high)
+        if i >= j:
+            return {"count": 0, "distinct": 0, "min": None, "max": None,
+                    "values": [], "matches": []}
+        vi = bisect_left(values, keys[i])
+        vj = bisect_right(values, keys[j-1])
+        counts = self.counts
+        return {
+            "count": j - i,
+            "distinct": vj - vi,
+            "min": keys[i],
+            "max": keys[j-1],
+            "values": [ (key, counts[key])
+                        for key in values[vi:min(vj, vi+limit)] ],
+            "matches": [ (URIRef(uri), key)
+                         for key, uri in self.entries[i:min(j, i+limit)] ],
+        }
+
+
+def typed_key(literal):
+    """Return the (kind, value) of `literal` used for indexing it.
+
+    Numbers are converted to python numbers, and date-times to naive UTC
+    datetimes (date-times without timezone are assumed to be in UTC).
+
+    If `literal` is not a (valid) typed literal of a supported datatype,
+    (None, None) is returned.
+    """
+    if not isinstance(literal, Literal):
+        return None, None
+    kind = KINDS.get(literal.datatype)
+    if kind is None:
+        return None, None
+    if kind is BOOLEAN:
+        lexical = unicode(literal).strip()
+        if lexical not in ("true", "false", "1", "0"):
+            return None, None
+        return kind, lexical in ("true", "1")
+    try:
+        value = literal.toPython()
+    except Exception: # catching Exception #pylint: disable=W0703
+        return None, None # ill-typed literal
+    if value is literal:
+        return None, None # not converted by rdflib
+    if kind is NUMBER:
+        if value != value or value in (float("inf"), float("-inf")):
+            return None, None # NaN and infinites can not be sorted
+    elif kind is DATETIME:
+        offset = value.utcoffset()
+        if offset is not None:
+            value = (value - offset).replace(tzinfo=None)
+    return kind, value
+
+def parse_bound(value, kind):
+    """Parse the bound of a range of values of the given `kind`.
+
+    :return: the parsed value, or None if `value` is not of that kind
+    """
+    if kind is NUMBER:
+        try:
+            ret = Decimal(value.strip())
+        except InvalidOperation:
+            return None
+        if not ret.is_finite():
+            return None
+        return ret
+    else:
+        datatype = { BOOLEAN: XSD.boolean, DATE: XSD.date,
+                     DATETIME: XSD.dateTime }[kind]
+        return typed_key(Literal(value.strip(), datatype=datatype))[1]
+
+
+class Facets(DerivedResource):
+    """I am the ``@facets`` resource of a SemWiki.
+
+    Without parameter, my state lists the indexed predicates (with the kind,
+    number, minimum and maximum of their values).
+
+    With parameter ``p`` (a predicate URI, or ``:name`` for a predicate in the
+    wiki), it describes the values of that predicate: their number (counted
+    with multiplicity), each distinct value with its number of topics, and
+    the topics with their values. The values can be restricted with
+    parameters ``min`` and/or ``max`` (included); only the kinds of values
+    for which these bounds are meaningful are then considered. The number of
+    values and topics listed is limited by parameter ``limit`` (defaults to
+    100).
+    """
+
+    RDF_MAIN_TYPE = SW.Facets
+    PARAMETERS = ("p", "min", "max", "limit")
+
+    def make_state(self, parameters):
+        """I implement `DerivedResource.make_state`.
+        """
+        uri = self.uri
+        index = self.service.facets
+        state = Graph(identifier=uri)
+        state.add((uri, RDF.type, SW.Facets))
+        predicate = parameters.get("p")
+        if predicate is None:
+            if len(parameters) > 0:
+                raise InvalidParametersError("Parameter p is required")
+            for pred, kind, count, low, high in index.get_facets():
+                facet = BNode()
+                state.add((uri, SW.facet, facet))
+                state.add((facet, SW.predicate, pred))
+                state.add((facet, SW.kind, Literal(kind)))
+                state.add((facet, SW.count, Literal(count)))
+                state.add((facet, SW.min, Literal(low)))
+                state.add((facet, SW.max, Literal(high)))
+            return state
+
+        if predicate.startswith(":"):
+            predicate = self.service.root_uri + predicate[1:]
+        predicate = URIRef(predicate)
+        limit = self.get_limit(parameters)
+        for kind in index.get_kinds(predicate):
+            bounds = []
+            for name in ("min", "max"):
+                value = parameters.get(name)
+                if value is not None:
+                    value = parse_bound(value, kind)
+                    if value is None:
+                        break # that bound is not meaningful for kind
+                bounds.append(value)
+            else:
+                result = index.query(predicate, kind, bounds[0], bounds[1],
+                                     limit)
+                if result["count"] == 0:
+                    continue
+                facet = BNode()
+                state.add((uri, SW.facet, facet))
+                state.add((facet, SW.predicate, predicate))
+                state.add((facet, SW.kind, Literal(kind)))
+                state.add((facet, SW.count, Literal(result["count"])))
+                state.add((facet, SW.distinct, Literal(result["distinct"])))
+                state.add((facet, SW.min, Literal(result["min"])))
+                state.add((facet, SW.max, Literal(result["max"])))
+                for value, count in result["values"]:
+                    node = BNode()
+                    state.add((facet, SW.value, node))
+                    state.add((node, SW.literal, Literal(value)))
+                    state.add((node, SW.count, Literal(count)))
+                for topic, value in result["matches"]:
+                    node = BNode()
+                    state.add((facet, SW.match, node))
+                    state.add((node, SW.topic, topic))
+                    state.add((node, SW.literal, Literal(value)))
+        return state
@@ -2,7 +2,7 @@
 """
 from rdflib import Graph, Literal, URIRef, XSD
 from rdfrest.exceptions import InvalidDataError
-from re import compile as regex, search, sub
+from re import compile as regex
 from StringIO import StringIO
 
 def make_initial_value(topic):
@@ -51,20 +51,55 @@ def add_triples(topic, wikitext, triples):
 
 def ban_triples(topic, wikitext, triples):
     """I return a version of `wikitext` where `triples` are removed and banned.
+
+    Semantic links expressing one of `triples` are replaced by their object,
+    except for lines generated by `add_triples`, which are removed. Only the
+    spans of those semantic links are rewritten, so the cost is linear in the
+    size of `wikitext`, whatever the number of `triples`.
     """
-    # unused argument (since itis not implemented yet) #pylint: disable=W0613
     wiki_uri = topic.service.root_uri
+    keys = set()
+    objects = set() # the possible texts of the banned objects
+    banned = []
     for _, pred, obj in triples:
-        pred = to_n3(pred, wiki_uri)
-        obj = to_n3(obj, wiki_uri)
-        sem_markup = r'%s->(%s)' % (pred, obj)
-        match = search(r'%s \(auto\)\n' % sem_markup, wikitext)
-        if match:
-            ifrom, ito = match.span()
-            wikitext = wikitext[:ifrom] + wikitext[ito:]
-        wikitext = sub(sem_markup, r'\1', wikitext)
-        wikitext += "\n# banned: %s->%s" % (pred, obj)
-    return wikitext
+        pred_n3 = to_n3(pred, wiki_uri)
+        obj_n3 = to_n3(obj, wiki_uri)
+        if isinstance(obj, URIRef):
+            keys.add((pred, obj))
+            objects.add("<%s>" % obj)
+        else:
+            keys.add((pred, obj_n3))
+        objects.add(obj_n3)
+        banned.append("\n# banned: %s->%s" % (pred_n3, obj_n3))
+
+    pieces = []
+    last = 0
+    for offset, line, match in _iter_sem_markup(wikitext):
+        obj = match.group(4)
+        obj_end = match.end()
+        if match.group(6) is not None:
+            # a quoted literal may be followed by a language or datatype
+            suffix = _LITERAL_SUFFIX.match(line, obj_end)
+            if suffix:
+                obj += suffix.group(0)
+                obj_end = suffix.end()
+        if obj not in objects \
+                or _sem_markup_key(match.groups(), obj, wiki_uri) not in keys:
+            continue
+        if match.start() == 0 and line[obj_end:] == " (auto)":
+            start = offset
+            end = offset + len(line) + 1
+            replacement = ""
+        else:
+            start = offset + match.start()
+            end = offset + obj_end
+            replacement = obj
+        pieces.append(wikitext[last:start])
+        pieces.append(replacement)
+        last = end
+    pieces.append(wikitext[last:])
+    pieces.extend(banned)
+    return "".join(pieces)
 
 def to_n3(node, wiki_uri):
     """Convert `node` to a nice serialization for the wikitext.
@@ -82,11 +117,69 @@ def to_n3(node, wiki_uri):
     else:
         raise InvalidDataError("Can not handle blank nodes in SemWiki")
 
-def wikitext_to_html(wikitext, resource):
+def iter_links(wikitext, wiki_uri):
+    """I yield the URIs of the topics linked by `wikitext`.
+
+    The predicates of semantic links are not considered as links, as they
+    denote properties rather than topics; their objects are.
+    """
+    for line in wikitext.split("\n"):
+        line = _COMMENT.sub("", line)
+        for groups in _SEM_MARKUP.findall(line):
+            match = _LINK.match(groups[4])
+            if match and match.end() == len(groups[4]):
+                yield _link_uri(match.groups(), wiki_uri)
+        line = _SEM_MARKUP.sub(" ", line)
+        for groups in _LINK.findall(line):
+            yield _link_uri(groups, wiki_uri)
+
+def _link_uri(groups, wiki_uri):
+    """Return the URI of a link matched by _LINK."""
+    if groups[1]:
+        return URIRef(groups[1])
+    else:
+        return URIRef(wiki_uri + groups[2])
+
+def _iter_sem_markup(wikitext):
+    """I yield the semantic links of `wikitext` that are not in a comment.
+
+    Each one is yielded as a tuple (offset, line, match) where `match` is
+    relative to `line`, which starts at `offset` in `wikitext`.
+    """
+    offset = 0
+    for line in wikitext.split("\n"):
+        if "->" not in line:
+            offset += len(line) + 1
+            continue
+        comment = _COMMENT.search(line)
+        end = comment.start() if comment else len(line)
+        for match in _SEM_MARKUP.finditer(line, 0, end):
+            yield offset, line, match
+        offset += len(line) + 1
+
+def _sem_markup_key(groups, obj, wiki_uri):
+    """Return a (predicate, object) key for a link matched by _SEM_MARKUP.
+
+    `obj` is the text of the object in the wikitext (including the language
+    or datatype of a quoted literal, which _SEM_MARKUP does not match). The
+    object of the key is a URIRef if it is a link, else that text (which, for
+    literals, is what `to_n3` generates).
+    """
+    match = _LINK.match(obj)
+    if match and match.end() == len(obj):
+        obj = _link_uri(match.groups(), wiki_uri)
+    return _link_uri(groups, wiki_uri), obj
+
+def wikitext_to_html(wikitext, resource, href=None):
     """I return the HTML corresponding to `wikitext`.
+
+    If provided, `href` is a function returning the target of a link given
+    its URI (e.g. to link the files of a static export rather than the URIs).
     """
     root_uri = resource.service.root_uri
     lines = []
+    if href is None:
+        href = lambda uri: uri
 
     def repl_sem_markup(match):
         """I replace a sem markup"""
@@ -96,17 +189,19 @@ def wikitext_to_html(wikitext, resource):
             link = groups[1]
         else:
             link = "%s%s" % (root_uri, groups[2])
-        ret += "<a href='%s'>*</a>" % link
+        ret += "<a href='%s'>*</a>" % href(link)
         return ret
 
     def repl_link(match):
         """I replace a link"""
         groups = match.groups()
         if groups[1]:
-            return "&lt;<a href='%s'>%s</a>&gt;" % (groups[1], groups[1])
+            return "&lt;<a href='%s'>%s</a>&gt;" % (href(groups[1]),
+                                                    groups[1])
         else:
             assert groups[2]
-            return "<a href='%s%s'>%s</a>" % (root_uri, groups[2], groups[2])
+            return "<a href='%s'>%s</a>" % (href(root_uri + groups[2]),
+                                            groups[2])
 
     for line in wikitext.split("\n"):
         if _WHOLE_LINE_COMMENT.match(line):
@@ -126,5 +221,6 @@ _INT_LINK = r":([A-Za-z][\w/]*)"
 _EXT_LINK = r"<([^/][^ >]*)>"
 _LINK = regex(r"(%s|%s)" % (_EXT_LINK, _INT_LINK))
 _SEM_MARKUP = regex(r'%s->(([^"\s]\S*)|"([^"]+)")' % _LINK.pattern)
+_LITERAL_SUFFIX = regex(r"@[A-Za-z0-9-]+|\^\^%s" % _EXT_LINK)
 _EMPH = regex(r"\*([^\*<]+)\*")
 _HR = regex(r"^----+$")
@@ -0,0 +1,163 @@
+"""
+I implement a compact storage for the revision history of topics.
+
+For each topic, every `snapshot_interval` revisions, a full snapshot is
+stored; the other revisions are stored as a delta from the previous revision:
+a line-based diff of the wikitext, and the sets of added and removed triples.
+Each record is compressed with zlib.
+
+Retrieving any revision therefore requires to decode one snapshot and at most
+`snapshot_interval`-1 deltas, while the storage cost of a frequently edited
+page is roughly the size of its deltas.
+
+Records are stored in a mapping with string keys and values, so that
+either a dict (in-memory history) or a `shelve` (persistent history) can be
+used.
+"""
+from difflib import SequenceMatcher
+from json import dumps, loads
+from rdflib import Graph, Literal
+from StringIO import StringIO
+from threading import Lock
+from zlib import compress, decompress
+
+from .namespace import SW
+
+class RevisionStore(object):
+    """I store the revisions of all the topics of a SemWiki.
+
+    :param storage:           a mapping from str to str (defaults to a new
+                              dict)
+    :param snapshot_interval: the number of revisions between two snapshots
+    """
+
+    def __init__(self, storage=None, snapshot_interval=16):
+        if storage is None:
+            storage = {}
+        assert snapshot_interval > 0
+        self.storage = storage
+        self.snapshot_interval = snapshot_interval
+        self._heads = {}
+        self._lock = Lock()
+
+    def count(self, uri):
+        """Return the number of revisions recorded for topic `uri`.
+        """
+        with self._lock:
+            return self._count(uri)
+
+    def record(self, uri, state):
+        """Record `state` as the new revision of topic `uri`.
+
+        :return: the number of the new revision (starting at 1)
+        """
+        wikitext, lines = _split_state(uri, state)
+        with self._lock:
+            rev = self._count(uri) + 1
+            if (rev - 1) % self.snapshot_interval == 0:
+                record = ["S", wikitext, sorted(lines)]
+            else:
+                old_wikitext, old_lines = self._head(uri, rev - 1)
+                record = ["D", diff_text(old_wikitext, wikitext),
+                          sorted(lines - old_lines),
+                          sorted(old_lines - lines)]
+            key = _key(uri)
+            storage = self.storage
+            storage["%s %s" % (key, rev)] = compress(dumps(record))
+            storage["%s count" % key] = str(rev)
+            self._heads[uri] = (wikitext, lines)
+        return rev
+
+    def get(self, uri, rev):
+        """Return the graph of revision `rev` of topic `uri`.
+
+        :raise: KeyError if that revision does not exist
+        """
+        with self._lock:
+            if not 1 <= rev <= self._count(uri):
+                raise KeyError("No revision %s for <%s>" % (rev, uri))
+            wikitext, lines = self._reconstruct(uri, rev)
+        graph = Graph(identifier=uri)
+        if lines:
+            graph.parse(StringIO((u" .\n".join(lines) + u" .\n")
+                                 .encode("utf-8")), format="n3")
+        graph.add((uri, SW.wikitext, Literal(wikitext)))
+        return graph
+
+    def _count(self, uri):
+        """Return the number of revisions of `uri` (lock must be held).
+        """
+        return int(self.storage.get("%s count" % _key(uri), 0))
+
+    def _head(self, uri, rev):
+        """Return the decoded last revision of `uri` (lock must be held).
+        """
+        head = self._heads.get(uri)
+        if head is None:
+            # e.g. when using a persistent storage after a restart
+            head = self._reconstruct(uri, rev)
+        return head
+
+    def _reconstruct(self, uri, rev):
+        """Return (wikitext, lines) of revision `rev` (lock must be held).
+        """
+        key = _key(uri)
+        first = rev - (rev - 1) % self.snapshot_interval
+        wikitext = None
+        lines = None
+        for i in range(first, rev + 1):
+            record = loads(decompress(self.storage["%s %s" % (key, i)]))
+            if record[0] == "S":
+                wikitext, lines = record[1], set(record[2])
+            else:
+                wikitext = patch_text(wikitext, record[1])
+                lines.update(record[2])
+                lines.difference_update(record[3])
+        return wikitext, lines
+
+
+def diff_text(old, new):
+    """Return a list of operations transforming text `old` into `new`.
+
+    Each operation is either a pair of integers [i, j], meaning that lines
+    i to j of `old` are copied, or a string, inserted as is.
+    """
+    old_lines = old.splitlines(True)
+    new_lines = new.splitlines(True)
+    matcher = SequenceMatcher(None, old_lines, new_lines, autojunk=False)
+    ops = []
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            ops.append([i1, i2])
+        elif j1 < j2:
+            ops.append(u"".join(new_lines[j1:j2]))
+    return ops
+
+def patch_text(old, ops):
+    """Apply operations computed by `diff_text` to text `old`.
+    """
+    old_lines = old.splitlines(True)
+    pieces = []
+    for op in ops:
+        if isinstance(op, list):
+            pieces.extend(old_lines[op[0]:op[1]])
+        else:
+            pieces.append(op)
+    return u"".join(pieces)
+
+def _key(uri):
+    """Return the storage key prefix for `uri`.
+    """
+    return unicode(uri).encode("utf-8")
+
+def _split_state(uri, state):
+    """Split `state` into its wikitext and a set of N3 lines for the others.
+    """
+    wikitext = u""
+    lines = set()
+    for triple in state:
+        if triple[1] == SW.wikitext and triple[0] == uri:
+            wikitext = unicode(triple[2])
+        else:
+            lines.add(u" ".join(node.n3() for node in triple))
+    return wikitext, lines
@@ -0,0 +1,244 @@
+"""
+I provide hooks allowing plugins to react to the edition of topics.
+
+Two kinds of hooks can be registered:
+
+* pre-commit hooks are called synchronously by `Topic.edit`, with the topic
+  and its new graph, once the new graph has been checked and before it is
+  committed; they can veto the edit by raising `InvalidDataError` (which
+  results in a 403 response), but must not modify the new graph;
+
+* post-commit hooks are called with an `EditEvent` after every change of a
+  topic (including changes received by a replica); they are called by a pool
+  of background threads, so that slow consumers (indexers, webhooks...) never
+  delay the edit itself.
+
+Hooks are called in increasing order of priority (then in the order of their
+registration). Post-commit events of a given topic are always delivered in
+the order of its revisions, as all events of a topic are handled by the
+same worker thread.
+
+Pre-commit hooks fail closed: any other exception they raise is logged, and
+vetoes the edit as an `InvalidDataError` would, as committing an edit that a
+validator could not check may break the invariants it enforces.
+Exceptions raised by post-commit hooks are logged and otherwise ignored, so
+that a faulty plugin can not break the wiki or other plugins.
+
+Each worker thread has a bounded queue; when it is full, events are waited
+for at most `put_timeout` seconds, then dropped (and counted as such).
+
+Plugins typically register their hooks in their `start_plugin` function::
+
+    from semwiki.hooks import register_post_commit
+
+    def start_plugin():
+        @register_post_commit(priority=10)
+        def log_edit(event):
+            print event.uri, event.revision
+"""
+from bisect import insort
+from collections import namedtuple
+from itertools import count
+import logging
+from Queue import Full, Queue
+from rdflib import Graph
+from rdfrest.exceptions import InvalidDataError
+from threading import Lock, Thread
+
+LOG = logging.getLogger(__name__)
+
+EditEvent = namedtuple("EditEvent", "service uri revision state")
+
+class HookRegistry(object):
+    """I hold pre-commit and post-commit hooks, and dispatch edit events to
+    them.
+
+    :param workers:     the number of threads calling post-commit hooks
+    :param queue_size:  the maximum number of pending events per thread
+    :param put_timeout: the time (in seconds) to wait for room in a full
+                        queue before dropping an event
+    """
+
+    def __init__(self, workers=2, queue_size=1000, put_timeout=0.0):
+        self._lock = Lock()
+        self._order = count()
+        self._pre_commit = []
+        self._post_commit = []
+        self._queues = None
+        self._dispatched = 0
+        self._delivered = 0
+        self._dropped = 0
+        self._failed = 0
+        self.configure(workers, queue_size, put_timeout)
+
+    def configure(self, workers=None, queue_size=None, put_timeout=None):
+        """Change the parameters of this registry.
+
+        This must be done before the first post-commit event is dispatched.
+        """
+        assert self._queues is None, "worker threads already started"
+        if workers is not None:
+            assert workers > 0
+            self.workers = workers
+        if queue_size is not None:
+            self.queue_size = queue_size
+        if put_timeout is not None:
+            self.put_timeout = put_timeout
+
+    def add_pre_commit(self, func, priority=0):
+        """Register `func(topic, new_graph)` as a pre-commit hook.
+        """
+        with self._lock:
+            insort(self._pre_commit, (priority, next(self._order), func))
+
+    def add_post_commit(self, func, priority=0):
+        """Register `func(event)` as a post-commit hook.
+        """
+        with self._lock:
+            insort(self._post_commit, (priority, next(self._order), func))
+
+    def remove(self, func):
+        """Unregister `func` (whatever its kind).
+        """
+        with self._lock:
+            self._pre_commit = [ i for i in self._pre_commit
+                                 if i[2] is not func ]
+            self._post_commit = [ i for i in self._post_commit
+                                  if i[2] is not func ]
+
+    def pre_commit(self, topic, new_graph):
+        """Call the pre-commit hooks.
+
+        :raise: InvalidDataError if a hook vetoes the edit, or fails
+        """
+        for _, _, func in self._pre_commit:
+            try:
+                func(topic, new_graph)
+            except InvalidDataError:
+                raise
+            except Exception: # catching Exception #pylint: disable=W0703
+                LOG.exception("pre-commit hook %r failed on <%s>",
+                              func, topic.uri)
+                raise InvalidDataError("could not validate the edit "
+                                       "(pre-commit hook failed)")
+
+    def post_commit(self, service, uri, revision, state):
+        """Dispatch an `EditEvent` to the post-commit hooks.
+
+        `state` is copied, so it can be modified once I return.
+
+        :return: False if the event had to be dropped, else True
+        """
+        if not self._post_commit:
+            return True
+        copy = Graph(identifier=uri)
+        copy_add = copy.add
+        for triple in state:
+            copy_add(triple)
+        event = EditEvent(service, uri, revision, copy)
+        queues = self._queues
+        if queues is None:
+            queues = self._start()
+        queue = queues[hash(unicode(uri)) % len(queues)]
+        try:
+            if self.put_timeout > 0:
+                queue.put(event, True, self.put_timeout)
+            else:
+                queue.put_nowait(event)
+        except Full:
+            with self._lock:
+                self._dropped += 1
+            LOG.warning("post-commit queue full, dropping event of <%s>",
+                        uri)
+            return False
+        with self._lock:
+            self._dispatched += 1
+        return True
+
+    def flush(self):
+        """Wait until all dispatched events have been handled.
+        """
+        for queue in self._queues or ():
+            queue.join()
+
+    def get_stats(self):
+        """Return a dict of statistics about post-commit events.
+        """
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "pending": sum( queue.qsize() for queue in self._queues or () ),
+                "dispatched": self._dispatched,
+                "delivered": self._delivered,
+                "dropped": self._dropped,
+                "failed": self._failed,
+            }
+
+    def _start(self):
+        """Start the worker threads, and return their queues.
+        """
+        with self._lock:
+            if self._queues is None:
+                queues = [ Queue(self.queue_size)
+                           for _ in range(self.workers) ]
+                for i, queue in enumerate(queues):
+                    thread = Thread(target=self._work, args=(queue,),
+                                    name="semwiki-hooks-%s" % i)
+                    thread.daemon = True
+                    thread.start()
+                self._queues = queues
+            return self._queues
+
+    def _work(self, queue):
+        """Deliver the events of `queue` to the post-commit hooks, forever.
+        """
+        while True:
+            event = queue.get()
+            try:
+                failed = 0
+                for _, _, func in self._post_commit:
+                    try:
+                        func(event)
+                    except Exception: # catching Exception #pylint: disable=W0703
+                        failed += 1
+                        LOG.exception("post-commit hook %r failed on <%s>",
+                                      func, event.uri)
+                with self._lock:
+                    self._delivered += 1
+                    self._failed += failed
+            finally:
+                queue.task_done()
+
+
+HOOKS = HookRegistry()
+
+def register_pre_commit(priority=0, registry=HOOKS):
+    """I return a decorator for registering a pre-commit hook.
+
+    The decorated function will be called with the edited topic and its new
+    graph (which it should not modify), and may raise `InvalidDataError` to
+    prevent the edit.
+    """
+    def decorator(func):
+        """The decorator to register a pre-commit hook."""
+        registry.add_pre_commit(func, priority)
+        return func
+    return decorator
+
+def register_post_commit(priority=0, registry=HOOKS):
+    """I return a decorator for registering a post-commit hook.
+
+    The decorated function will be called, in a background thread, with an
+    `EditEvent` every time a topic is changed.
+    """
+    def decorator(func):
+        """The decorator to register a post-commit hook."""
+        registry.add_post_commit(func, priority)
+        return func
+    return decorator
+
+def unregister_hook(func, registry=HOOKS):
+    """I unregister a hook previously registered with `register_pre_commit`
+    or `register_post_commit`.
+    """
+    registry.remove(func)
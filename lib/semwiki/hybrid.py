@@ -0,0 +1,209 @@
+"""
+I implement a hybrid RDF store, keeping the most recently used subjects in
+memory, in front of a (typically on-disk) store holding all the triples.
+
+As all the triples of a topic share the same subject, caching by subject
+keeps hot topics in memory, while cold ones only live in the underlying
+store. The size of the cache is bounded by a budget, expressed as a number of
+triples (not of bytes: the memory used by a triple depends on the length of
+its literals, e.g. the wikitext); when it is exceeded, the least recently
+used subjects are evicted.
+
+The store is write-through: every write is applied to the underlying store
+(and to the cache if the subject is resident), so eviction never requires to
+write anything, and the underlying store is always up to date (e.g. after a
+crash); writes are therefore not faster than with the underlying store alone.
+Removing a triple of a resident subject costs O(k), k being the number of
+resident triples of that subject. Queries with a bound subject are answered
+from the cache (loading the subject if needed); other queries are delegated
+to the underlying store.
+"""
+from collections import OrderedDict
+from rdflib.store import Store
+from threading import RLock
+
+class HybridStore(Store):
+    """I cache the triples of recently used subjects of another store.
+
+    :param cold:   the underlying store, containing all the triples
+    :param budget: the maximum number of triples (not bytes) kept in memory
+    """
+    context_aware = True
+
+    def __init__(self, cold, budget):
+        Store.__init__(self)
+        assert budget > 0
+        self.cold = cold
+        self.budget = budget
+        self.transaction_aware = cold.transaction_aware
+        self._lock = RLock()
+        self._cache = OrderedDict()
+        self._resident = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def get_stats(self):
+        """Return a dict of statistics about the cache.
+        """
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "budget": self.budget,
+                "resident_subjects": len(self._cache),
+                "resident_triples": self._resident,
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+                "hit_rate": lookups and float(self._hits) / lookups or 0.0,
+            }
+
+    ######## rdflib.store.Store implementation  ########
+
+    def add(self, triple, context, quoted=False):
+        Store.add(self, triple, context, quoted)
+        with self._lock:
+            self.cold.add(triple, context, quoted)
+            entry = self._cache.get(triple[0])
+            if entry is not None:
+                key = triple[1:]
+                contexts = entry.get(key)
+                if contexts is None:
+                    entry[key] = [context]
+                    self._resident += 1
+                    self._evict()
+                elif _find(contexts, context) is None:
+                    contexts.append(context)
+
+    def remove(self, triple, context=None):
+        Store.remove(self, triple, context)
+        subject, predicate, obj = triple
+        with self._lock:
+            self.cold.remove(triple, context)
+            if subject is None:
+                # can not be done by subject, so drop everything
+                self._cache.clear()
+                self._resident = 0
+                return
+            entry = self._cache.get(subject)
+            if entry is None:
+                return
+            for key in entry.keys():
+                if predicate is not None and key[0] != predicate \
+                        or obj is not None and key[1] != obj:
+                    continue
+                contexts = entry[key]
+                if context is not None:
+                    i = _find(contexts, context)
+                    if i is None:
+                        continue
+                    del contexts[i]
+                if context is None or not contexts:
+                    del entry[key]
+                    self._resident -= 1
+
+    def triples(self, triple_pattern, context=None):
+        subject, predicate, obj = triple_pattern
+        if subject is None:
+            for ret in self.cold.triples(triple_pattern, context):
+                yield ret
+            return
+        # the results are computed while holding the lock, and yielded after,
+        # so that the cache can change in the meantime
+        results = []
+        with self._lock:
+            entry = self._load(subject)
+            if predicate is not None:
+                if obj is not None:
+                    keys = [(predicate, obj)]
+                else:
+                    keys = [ key for key in entry if key[0] == predicate ]
+            elif obj is not None:
+                keys = [ key for key in entry if key[1] == obj ]
+            else:
+                keys = entry.keys()
+            for key in keys:
+                contexts = entry.get(key)
+                if contexts is None or context is not None \
+                        and _find(contexts, context) is None:
+                    continue
+                results.append(((subject, key[0], key[1]), list(contexts)))
+        for triple, contexts in results:
+            yield triple, iter(contexts)
+
+    def __len__(self, context=None):
+        return self.cold.__len__(context)
+
+    def contexts(self, triple=None):
+        return self.cold.contexts(triple)
+
+    def bind(self, prefix, namespace):
+        return self.cold.bind(prefix, namespace)
+
+    def prefix(self, namespace):
+        return self.cold.prefix(namespace)
+
+    def namespace(self, prefix):
+        return self.cold.namespace(prefix)
+
+    def namespaces(self):
+        return self.cold.namespaces()
+
+    def commit(self):
+        return self.cold.commit()
+
+    def rollback(self):
+        with self._lock:
+            # the cache may contain rolled back triples
+            self._cache.clear()
+            self._resident = 0
+            return self.cold.rollback()
+
+    def close(self, commit_pending_transaction=False):
+        return self.cold.close(commit_pending_transaction)
+
+    ######## Private methods  ########
+
+    def _load(self, subject):
+        """Return the cache entry of `subject`, loading it if needed.
+
+        An entry maps (predicate, object) pairs to lists of contexts.
+        (lock must be held)
+        """
+        cache = self._cache
+        entry = cache.pop(subject, None)
+        if entry is not None:
+            self._hits += 1
+            cache[subject] = entry # most recently used
+            return entry
+        self._misses += 1
+        entry = {}
+        for (_, predicate, obj), contexts \
+                in self.cold.triples((subject, None, None), None):
+            entry[(predicate, obj)] = list(contexts)
+        cache[subject] = entry
+        self._resident += len(entry)
+        self._evict()
+        return entry
+
+    def _evict(self):
+        """Evict the least recently used subjects to fit in the budget.
+
+        The most recently used subject is never evicted, even if it alone
+        exceeds the budget. (lock must be held)
+        """
+        cache = self._cache
+        while self._resident > self.budget and len(cache) > 1:
+            _, entry = cache.popitem(last=False)
+            self._resident -= len(entry)
+            self._evictions += 1
+
+
+def _find(contexts, context):
+    """Return the index of `context` in `contexts`, or None.
+    """
+    identifier = getattr(context, "identifier", context)
+    for i, ctx in enumerate(contexts):
+        if getattr(ctx, "identifier", ctx) == identifier:
+            return i
+    return None
@@ -40,6 +40,29 @@ SW_NS_TTL = """
 :SemWiki a owl:Class .
 :Topic a owl:Class .
 
+# derived resources
+
+:Facets a owl:Class .
+:facet a owl:ObjectProperty .
+:predicate a owl:ObjectProperty .
+:kind a owl:DatatypeProperty .
+:count a owl:DatatypeProperty .
+:distinct a owl:DatatypeProperty .
+:min a owl:DatatypeProperty .
+:max a owl:DatatypeProperty .
+:value a owl:ObjectProperty .
+:literal a owl:DatatypeProperty .
+:match a owl:ObjectProperty .
+:topic a owl:ObjectProperty .
+
+:Report a owl:Class .
+:topicCount a owl:DatatypeProperty .
+:danglingCount a owl:DatatypeProperty .
+:orphanCount a owl:DatatypeProperty .
+:dangling a owl:ObjectProperty .
+:orphan a owl:ObjectProperty .
+:linkedFrom a owl:ObjectProperty .
+
 # TODO define it
 
 """ % SW_NS_URI
@@ -59,6 +82,15 @@ SW = ClosedNamespace(SW_NS_URI + "#",
                        SW_IDENTIFIERS,
                        )
 
+def uri_key(uri):
+    """Return the key identifying `uri` in the dicts and sets of SemWiki.
+
+    Keys are plain unicode strings, as a URIRef never equals a unicode string
+    (with rdflib 3): a URIRef key would not be found with the same URI read
+    from another source (e.g. a JSON file).
+    """
+    return unicode(uri)
+
 class _SemWikiNsResource(StandaloneResource):
     """I am the only resource class of SW_NS_SERVICE.
 
@@ -0,0 +1,467 @@
+"""
+I implement primary/replica replication of a SemWiki.
+
+The primary keeps a :class:`ChangeLog` of every committed edit, and publishes
+it over HTTP with :class:`ChangeLogPublisher`. A replica keeps its own store,
+which a :class:`ReplicaFollower` keeps up to date by polling the primary's
+change log, and serves reads through a :class:`ReplicaFrontend`.
+
+Every entry of the change log carries the *whole* new state of the edited
+topic, so applying an entry is idempotent; this allows a lagging (or
+restarted) replica to resynchronize from a snapshot of the primary and
+simply replay the entries committed while the snapshot was being made.
+"""
+from collections import deque
+from httplib import HTTPConnection
+from json import dumps, loads
+import logging
+from rdflib import Graph, URIRef
+from rdfrest.utils import random_token
+from StringIO import StringIO
+from threading import Lock, Thread
+from time import sleep, time
+from urllib import urlencode
+from urllib2 import urlopen
+from urlparse import parse_qs, urlsplit
+from wsgiref.util import request_uri
+
+LOG = logging.getLogger(__name__)
+
+class ChangeLog(object):
+    """I record the ordered sequence of edits committed on a primary.
+
+    Each entry is a tuple (seq, timestamp, uri, ntriples), where ntriples is
+    the new state of the topic serialized as N-Triples.
+
+    Only the last `maxlen` entries are kept; replicas lagging further behind
+    have to resynchronize from a snapshot.
+    """
+
+    def __init__(self, maxlen=10000):
+        self.epoch = random_token(16)
+        self._entries = deque(maxlen=maxlen)
+        self._last = 0
+        self._lock = Lock()
+
+    @property
+    def last(self):
+        """The sequence number of the last recorded edit (0 if none).
+        """
+        return self._last
+
+    def append(self, uri, graph):
+        """Record that the state of topic `uri` is now `graph`.
+
+        :return: the sequence number of the new entry
+        """
+        ntriples = graph.serialize(format="nt")
+        with self._lock:
+            self._last = seq = self._last + 1
+            self._entries.append((seq, time(), unicode(uri), ntriples))
+        return seq
+
+    def since(self, seq, limit=None):
+        """Return the entries following `seq`, or None.
+
+        None is returned if some of those entries have already been discarded,
+        or if `seq` is in the future (which means that the requester is
+        following another incarnation of this change log).
+        """
+        with self._lock:
+            if seq > self._last:
+                return None
+            if self._entries:
+                first = self._entries[0][0]
+            else:
+                first = self._last + 1
+            if seq < first - 1:
+                return None
+            ret = [ i for i in self._entries if i[0] > seq ]
+        if limit is not None:
+            ret = ret[:limit]
+        return ret
+
+
+def iter_topic_states(service):
+    """Iter over all the topics stored in `service`.
+
+    :return: an iterator of tuples (uri, graph)
+    """
+    root_uri = service.root_uri
+    graph = Graph(service.store, root_uri)
+    with service.store_lock:
+        subjects = set(graph.subjects())
+    subjects.discard(root_uri)
+    for uri in subjects:
+        state = Graph(identifier=uri)
+        state_add = state.add
+        with service.store_lock:
+            for triple in graph.triples((uri, None, None)):
+                state_add(triple)
+        yield uri, state
+
+def apply_state(service, uri, state):
+    """Replace the stored state of topic `uri` by the triples of `state`.
+
+    This bypasses all the checks of `.service.Topic.edit`, so `state` must
+    come from a trusted source (e.g. the change log of the primary).
+    """
+    graph = Graph(service.store, service.root_uri)
+    with service.topic_lock(uri):
+        with service.store_lock, service:
+            graph.remove((uri, None, None))
+            graph_add = graph.add
+            for triple in state:
+                graph_add(triple)
+        service.topic_changed(uri, state)
+
+def make_change_doc(service, changelog, since, epoch, limit=1000):
+    """I return the change-log document answering a replica's request.
+
+    If the replica can not be served incrementally (unknown epoch, or
+    entries already discarded), a snapshot of the whole wiki is returned.
+
+    The document also gives the time of the first change that it does not
+    contain ('next_time', None if there is none), so that the replica knows
+    how late it is.
+    """
+    entries = None
+    if epoch == changelog.epoch:
+        entries = changelog.since(since, limit + 1)
+    if entries is not None:
+        changes = [ {"seq": seq, "time": timestamp, "uri": uri,
+                     "ntriples": ntriples}
+                    for seq, timestamp, uri, ntriples in entries[:limit] ]
+        snapshot = False
+        last = since if not changes else changes[-1]["seq"]
+    else:
+        # entries committed during the snapshot will be replayed,
+        # which is harmless as they are idempotent
+        last = changelog.last
+        changes = [ {"seq": last, "time": None, "uri": unicode(uri),
+                     "ntriples": state.serialize(format="nt")}
+                    for uri, state in iter_topic_states(service) ]
+        snapshot = True
+    following = changelog.since(last, 1)
+    return {
+        "root": unicode(service.root_uri),
+        "epoch": changelog.epoch,
+        "last": changelog.last,
+        "snapshot": snapshot,
+        "changes": changes,
+        "next_time": following[0][1] if following else None,
+    }
+
+
+class ChangeLogPublisher(object):
+    """
+    I wrap a WSGI application in order to publish the change log of a primary.
+
+    The change log is served at `path`, and accepts parameters `since` (the
+    last sequence number known by the replica), `epoch` and `limit` (the
+    maximum number of changes returned, at most MAX_LIMIT).
+    """
+    #pylint: disable-msg=R0903
+    #    too few public methods
+
+    MAX_LIMIT = 1000
+
+    def __init__(self, app, service, path="/@changes"):
+        """
+        * app: the wrapped WSGI application
+        * service: the SemWikiService whose change log is published
+        * path: the path where the change log is served
+        """
+        self.app = app
+        self.service = service
+        self.path = path
+
+    def __call__(self, env, start_response):
+        if env["PATH_INFO"] != self.path:
+            return self.app(env, start_response)
+        params = parse_qs(env.get("QUERY_STRING", ""))
+        try:
+            since = int(params.get("since", ["0"])[0])
+            limit = int(params.get("limit", [self.MAX_LIMIT])[0])
+            if limit < 1:
+                raise ValueError(limit)
+        except ValueError:
+            start_response("400 Bad Request",
+                           [("content-type", "text/plain")])
+            return ["400 Bad Request\nparameters 'since' and 'limit' must be "
+                    "integers"]
+        epoch = params.get("epoch", [None])[0]
+        body = dumps(make_change_doc(self.service, self.service.changelog,
+                                     since, epoch,
+                                     min(limit, self.MAX_LIMIT)))
+        start_response("200 OK", [
+            ("content-type", "application/json"),
+            ("content-length", str(len(body))),
+            ("cache-control", "no-cache"),
+        ])
+        return [body]
+
+
+class ReplicaFollower(object):
+    """I keep the store of a replica up to date with the primary.
+
+    :param service:     the local SemWikiService
+    :param primary_uri: the root URI of the primary SemWiki
+    :param interval:    the delay (in seconds) between two polls when the
+                        replica is up to date
+    :param batch:       the maximum number of changes fetched by one poll
+                        (None for the primary's maximum)
+    """
+
+    def __init__(self, service, primary_uri, interval=1.0,
+                 path="@changes", batch=None):
+        self.service = service
+        self.primary_uri = primary_uri
+        self.changes_uri = primary_uri + path
+        self.interval = interval
+        self.batch = batch
+        self.epoch = None
+        self.applied = 0
+        self.primary_last = 0
+        self.last_contact = None
+        self.error = None
+        self._oldest_pending = None
+        self._running = False
+        self._thread = None
+
+    def poll(self):
+        """Fetch and apply the next batch of changes from the primary.
+
+        :return: True if more changes are pending on the primary
+        """
+        query = {"since": self.applied}
+        if self.epoch is not None:
+            query["epoch"] = self.epoch
+        if self.batch is not None:
+            query["limit"] = self.batch
+        stream = urlopen("%s?%s" % (self.changes_uri, urlencode(query)),
+                         timeout=30)
+        try:
+            doc = loads(stream.read())
+        finally:
+            stream.close()
+        self.last_contact = time()
+
+        primary_root = doc["root"]
+        local_root = self.service.root_uri
+        def translate(node):
+            "Rename the nodes of the primary into nodes of the replica"
+            if isinstance(node, URIRef) and node.startswith(primary_root):
+                return URIRef(local_root + node[len(primary_root):])
+            return node
+
+        if doc["snapshot"]:
+            LOG.info("resynchronizing from snapshot of %s", self.primary_uri)
+            # topics are replaced one by one, so that the replica keeps
+            # serving them; those missing from the snapshot are removed after
+            stale = self._local_topics()
+        else:
+            stale = None
+        for change in doc["changes"]:
+            state = Graph()
+            state.parse(StringIO(change["ntriples"].encode("utf-8")),
+                        format="nt")
+            uri = translate(URIRef(change["uri"]))
+            local_state = Graph(identifier=uri)
+            local_add = local_state.add
+            for subj, pred, obj in state:
+                local_add((translate(subj), translate(pred), translate(obj)))
+            if stale is not None:
+                stale.discard(uri)
+                if self._is_unchanged(uri, local_state):
+                    continue
+            apply_state(self.service, uri, local_state)
+        if stale:
+            for uri in stale:
+                apply_state(self.service, uri, Graph(identifier=uri))
+
+        self.epoch = doc["epoch"]
+        self.primary_last = doc["last"]
+        if doc["changes"]:
+            self.applied = doc["changes"][-1]["seq"]
+        else:
+            self.applied = doc["last"]
+        # older primaries do not provide next_time
+        self._oldest_pending = doc.get("next_time")
+        return self.applied < self.primary_last
+
+    def start(self):
+        """Start following the primary in a background thread.
+        """
+        self._running = True
+        self._thread = thread = Thread(target=self._run,
+                                       name="replica-follower")
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        """Stop following the primary.
+        """
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def status(self):
+        """Return a dict describing the replication state of this replica.
+
+        The state of the primary is only known as of the last poll, so
+        'lag_changes' (the number of changes not applied yet) is only as fresh
+        as 'last_contact' (the number of seconds since the last poll).
+        'lag_seconds' is the age of the oldest change not applied yet (0 if
+        there was none at the last poll, None if it is unknown).
+        """
+        now = time()
+        if self.applied >= self.primary_last:
+            lag_seconds = 0.0
+        elif self._oldest_pending is not None:
+            lag_seconds = max(0.0, now - self._oldest_pending)
+        else:
+            lag_seconds = None
+        if self.last_contact is None:
+            last_contact = None
+        else:
+            last_contact = now - self.last_contact
+        return {
+            "primary": self.primary_uri,
+            "epoch": self.epoch,
+            "applied": self.applied,
+            "primary_last": self.primary_last,
+            "lag_changes": max(0, self.primary_last - self.applied),
+            "lag_seconds": lag_seconds,
+            "last_contact": last_contact,
+            "error": self.error,
+        }
+
+    def _run(self):
+        """I poll the primary until stopped.
+        """
+        while self._running:
+            try:
+                more = self.poll()
+                self.error = None
+            except Exception, ex: # catching Exception #pylint: disable=W0703
+                LOG.warning("could not poll %s: %s", self.changes_uri, ex)
+                self.error = str(ex)
+                more = False
+            if not more:
+                sleep(self.interval)
+
+    def _local_topics(self):
+        """Return the set of the topics in the local store.
+        """
+        service = self.service
+        graph = Graph(service.store, service.root_uri)
+        with service.store_lock:
+            ret = set(graph.subjects())
+        ret.discard(service.root_uri)
+        return ret
+
+    def _is_unchanged(self, uri, state):
+        """Return True if the local state of topic `uri` is `state`.
+        """
+        service = self.service
+        graph = Graph(service.store, service.root_uri)
+        with service.store_lock:
+            local = set(graph.triples((uri, None, None)))
+        return local == set(state)
+
+
+class ReplicaFrontend(object):
+    """
+    I wrap the WSGI application of a replica.
+
+    I serve read requests, and either reject write requests or forward them
+    to the primary. I also serve the replication status at `path`, and
+    advertise the replication lag in every response.
+    """
+    #pylint: disable-msg=R0903
+    #    too few public methods
+
+    READ_METHODS = frozenset(["GET", "HEAD", "OPTIONS"])
+
+    def __init__(self, app, follower, forward=False, path="/@replication"):
+        """
+        * app: the wrapped WSGI application
+        * follower: the ReplicaFollower of this replica
+        * forward: whether write requests are forwarded to the primary
+        * path: the path where the replication status is served
+        """
+        self.app = app
+        self.follower = follower
+        self.forward = forward
+        self.path = path
+
+    def __call__(self, env, start_response):
+        status = self.follower.status()
+        lag_header = ("x-replication-lag", str(status["lag_changes"]))
+        if env["PATH_INFO"] == self.path:
+            body = dumps(status)
+            start_response("200 OK", [
+                ("content-type", "application/json"),
+                ("content-length", str(len(body))),
+                ("cache-control", "no-cache"),
+                lag_header,
+            ])
+            return [body]
+        if env["REQUEST_METHOD"] not in self.READ_METHODS:
+            if self.forward:
+                return self._forward(env, start_response)
+            msg = "405 Method Not Allowed\nThis is a read-only replica of %s" \
+                % str(self.follower.primary_uri)
+            start_response("405 Method Not Allowed", [
+                ("content-type", "text/plain"),
+                ("content-length", str(len(msg))),
+                ("allow", "GET, HEAD, OPTIONS"),
+                lag_header,
+            ])
+            return [msg]
+
+        def replica_start_response(status, headers, exc_info=None):
+            "Add the replication lag to the response headers"
+            return start_response(status, headers + [lag_header], exc_info)
+        return self.app(env, replica_start_response)
+
+    def _forward(self, env, start_response):
+        """Forward the request described by `env` to the primary.
+        """
+        local_root = self.follower.service.root_uri
+        primary_root = self.follower.primary_uri
+        uri = request_uri(env)
+        if uri.startswith(local_root):
+            uri = primary_root + uri[len(local_root):]
+        _, netloc, path, query, _ = urlsplit(uri)
+        if query:
+            path = "%s?%s" % (path, query)
+        length = int(env.get("CONTENT_LENGTH") or 0)
+        body = env["wsgi.input"].read(length)
+        headers = {}
+        for key, value in env.items():
+            if key.startswith("HTTP_") and key not in _HOP_BY_HOP_ENV:
+                headers[key[5:].replace("_", "-").title()] = value
+        if env.get("CONTENT_TYPE"):
+            headers["Content-Type"] = env["CONTENT_TYPE"]
+        headers["Host"] = netloc
+
+        cnx = HTTPConnection(netloc, timeout=30)
+        try:
+            cnx.request(env["REQUEST_METHOD"], path, body, headers)
+            resp = cnx.getresponse()
+            payload = resp.read()
+            resp_headers = [ (key, value) for key, value in resp.getheaders()
+                             if key.lower() not in _HOP_BY_HOP ]
+            start_response("%s %s" % (resp.status, resp.reason), resp_headers)
+        finally:
+            cnx.close()
+        return [payload]
+
+_HOP_BY_HOP = frozenset(["connection", "keep-alive", "proxy-authenticate",
+                         "proxy-authorization", "te", "trailers",
+                         "transfer-encoding", "upgrade"])
+_HOP_BY_HOP_ENV = frozenset([ "HTTP_" + i.upper().replace("-", "_")
+                              for i in _HOP_BY_HOP ] + ["HTTP_HOST"])
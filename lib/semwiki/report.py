@@ -0,0 +1,202 @@
+"""
+I implement a report about the health of the links of a SemWiki.
+
+The report lists:
+
+* dangling links, i.e. topics that are linked but were never written (or were
+  removed), with the topics linking to them;
+* orphan topics, i.e. existing topics that no other topic links to (the home
+  page is linked by the wiki itself).
+
+The links of every topic, and the set of existing topics, are maintained
+incrementally by `SemWikiService.topic_changed`, so that the report is
+available without crawling the whole wiki. It is served as the ``@report``
+resource of the SemWiki.
+"""
+from itertools import islice
+from rdflib import BNode, Graph, Literal, RDF, URIRef
+from threading import Lock
+
+from .derived import DerivedResource
+from .format import iter_links
+from .namespace import SW, uri_key
+
+class LinkReport(object):
+    """I keep track of the links between topics, and of existing topics.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._links = {}
+        self._linked_from = {}
+        self._exists = set()
+        self._dangling = set()
+        self._orphans = set()
+
+    def update(self, uri, exists, links):
+        """Record the existence and the outgoing `links` of topic `uri`.
+
+        `links` may contain the same target several times (see
+        `topic_links`).
+        """
+        uri = uri_key(uri)
+        counts = {}
+        for target in links:
+            target = uri_key(target)
+            if target != uri:
+                counts[target] = counts.get(target, 0) + 1
+        with self._lock:
+            old_counts = self._links.pop(uri, {})
+            if counts:
+                self._links[uri] = counts
+            for target in old_counts:
+                if target not in counts:
+                    self._unlink(uri, target)
+            for target in counts:
+                if target not in old_counts:
+                    self._link(uri, target)
+            self._set_exists(uri, exists)
+
+    def change(self, uri, exists, added, removed):
+        """Record the existence of topic `uri`, and the change of its
+        outgoing links, `added` and `removed` being the links of the triples
+        added to and removed from it (see `topic_links`).
+
+        Unlike `update`, this only costs the size of the change.
+        """
+        uri = uri_key(uri)
+        with self._lock:
+            counts = self._links.get(uri, {})
+            # added first, so that a link that is both added and removed is
+            # never (even temporarily) reported as dropped
+            for target in added:
+                target = uri_key(target)
+                if target != uri:
+                    count = counts.get(target, 0)
+                    counts[target] = count + 1
+                    if not count:
+                        self._link(uri, target)
+            for target in removed:
+                target = uri_key(target)
+                if target != uri:
+                    count = counts[target] - 1
+                    if count:
+                        counts[target] = count
+                    else:
+                        del counts[target]
+                        self._unlink(uri, target)
+            if counts:
+                self._links[uri] = counts
+            else:
+                self._links.pop(uri, None)
+            self._set_exists(uri, exists)
+
+    def _link(self, source, target):
+        """Record a new link, while holding the lock."""
+        sources = self._linked_from.get(target)
+        if sources is None:
+            sources = self._linked_from[target] = set()
+            if target in self._exists:
+                self._orphans.discard(target)
+            else:
+                self._dangling.add(target)
+        sources.add(source)
+
+    def _unlink(self, source, target):
+        """Record a dropped link, while holding the lock."""
+        sources = self._linked_from[target]
+        sources.discard(source)
+        if not sources:
+            del self._linked_from[target]
+            if target in self._exists:
+                self._orphans.add(target)
+            else:
+                self._dangling.discard(target)
+
+    def _set_exists(self, uri, exists):
+        """Record the existence of topic `uri`, while holding the lock."""
+        if exists and uri not in self._exists:
+            self._exists.add(uri)
+            self._dangling.discard(uri)
+            if uri not in self._linked_from:
+                self._orphans.add(uri)
+        elif not exists and uri in self._exists:
+            self._exists.discard(uri)
+            self._orphans.discard(uri)
+            if uri in self._linked_from:
+                self._dangling.add(uri)
+
+    def get_report(self, limit=100):
+        """Return a dict describing the state of the links.
+
+        The dict contains the number of existing 'topics', of 'dangling'
+        links and of 'orphans', a list of at most `limit` dangling links
+        (each as a pair whose second item is a list of at most `limit`
+        topics linking to it) and a list of at most `limit` orphans
+        ('dangling_list' and 'orphan_list').
+        """
+        with self._lock:
+            linked_from = self._linked_from
+            return {
+                "topics": len(self._exists),
+                "dangling": len(self._dangling),
+                "orphans": len(self._orphans),
+                "dangling_list": [
+                    (URIRef(target),
+                     [ URIRef(i) for i in islice(linked_from[target], limit) ])
+                    for target in islice(self._dangling, limit) ],
+                "orphan_list": [ URIRef(i)
+                                 for i in islice(self._orphans, limit) ],
+            }
+
+
+def topic_links(service, triples):
+    """Return the list of topics linked by the given `triples` of a topic.
+
+    Links are found in the wikitext (where each topic is listed once), and in
+    the other triples (each one listing the topic it links to). A topic may
+    therefore be listed several times, so that the links of a topic can be
+    updated with the links of its added and removed triples only.
+    """
+    links = []
+    is_topic_uri = service.is_topic_uri
+    for _, pred, obj in triples:
+        if pred == SW.wikitext:
+            links.extend( i for i in set(iter_links(obj, service.root_uri))
+                          if is_topic_uri(i) )
+        elif isinstance(obj, URIRef) and is_topic_uri(obj):
+            links.append(obj)
+    return links
+
+
+class Report(DerivedResource):
+    """I am the ``@report`` resource of a SemWiki.
+
+    My state gives the number of topics, dangling links and orphan topics,
+    and lists them; the length of those lists is limited by parameter
+    ``limit`` (defaults to 100).
+    """
+
+    RDF_MAIN_TYPE = SW.Report
+    PARAMETERS = ("limit",)
+
+    def make_state(self, parameters):
+        """I implement `DerivedResource.make_state`.
+        """
+        limit = self.get_limit(parameters)
+        report = self.service.links.get_report(limit)
+        uri = self.uri
+        state = Graph(identifier=uri)
+        state.add((uri, RDF.type, SW.Report))
+        state.add((uri, SW.topicCount, Literal(report["topics"])))
+        state.add((uri, SW.danglingCount, Literal(report["dangling"])))
+        state.add((uri, SW.orphanCount, Literal(report["orphans"])))
+        for target, sources in report["dangling_list"]:
+            node = BNode()
+            state.add((uri, SW.dangling, node))
+            state.add((node, SW.topic, target))
+            for source in sources:
+                state.add((node, SW.linkedFrom, source))
+        for orphan in report["orphan_list"]:
+            state.add((uri, SW.orphan, orphan))
+        return state
@@ -3,9 +3,10 @@ Serializers and Parsers for SemWiki
 """
 
 from rdflib import Graph, Literal, RDF, URIRef
+from urllib import quote
 from rdfrest.parsers import register_parser, ParseError, wrap_exceptions
-from rdfrest.serializers import iter_serializers, register_serializer, \
-    SerializeError
+from rdfrest.serializers import get_serializer_by_extension, \
+    iter_serializers, register_serializer, SerializeError
 from rdfrest.serializers_html import serialize_htmlized_turtle, \
     generate_ajax_client_js, generate_crumbs, generate_formats
 
@@ -84,3 +85,62 @@ def serialize_html(graph, resource, bindings=None):
                                      generate_header=generate_header,
                                      generate_body=render_wikitext,
                                      )
+
+
+## Static HTML (for exports)
+
+def serialize_static_html(graph, resource, formats):
+    """I render a topic as a page of a static export.
+
+    Links to topics target their exported HTML file (relatively), only the
+    exported `formats` (file extensions) are listed, and the page contains
+    no edit client, as the export is read-only.
+    """
+    ctypes = {}
+    for ext in formats:
+        _, ctype = get_serializer_by_extension(ext, SW.Topic)
+        ctypes[ctype] = ext
+    return serialize_htmlized_turtle(graph, resource, {}, ctypes,
+                                     generate_script=generate_static_js,
+                                     generate_header=generate_static_header,
+                                     generate_body=render_static_wikitext,
+                                     generate_footer=generate_static_footer,
+                                     )
+
+def static_href(uri, resource):
+    """Return the link from the exported page of `resource` to `uri`.
+
+    Topics are linked to their exported HTML file, with a relative path;
+    other URIs are returned unchanged.
+    """
+    service = resource.service
+    if not service.is_topic_uri(uri):
+        return uri
+    root_uri = service.root_uri
+    depth = resource.uri[len(root_uri):].count("/")
+    return "../" * depth + quote(uri[len(root_uri):].encode("utf-8")) + ".html"
+
+def generate_static_js(_graph, _resource, _bindings, _ctypes):
+    """I generate the (empty) script of a static page."""
+    # the body of the page calls rdfrest_init_editor on load
+    return "function rdfrest_init_editor() {}"
+
+def generate_static_header(_graph, resource, _bindings, ctypes):
+    """I generate a header with the name of the topic and the format list.
+    """
+    name = resource.uri[len(resource.service.root_uri):]
+    basename = quote(name.rsplit("/", 1)[-1].encode("utf-8"))
+    return ("<h1>%s</h1>\n<div class='formats'>#\n" % name
+            + "".join("<a href='%s.%s'>%s</a>\n" % (basename, ext, ext)
+                      for ext in sorted(ctypes.itervalues()))
+            + "</div>\n")
+
+def render_static_wikitext(graph, resource, _bindings, _ctypes):
+    """I render the wikitext of resource, linking exported files."""
+    wikitext = graph.value(URIRef(resource.uri), SW.wikitext)
+    href = lambda uri: static_href(uri, resource)
+    return "<pre>\n%s</pre>\n" % wikitext_to_html(wikitext, resource, href)
+
+def generate_static_footer(_graph, _resource, _bindings, _ctypes):
+    """I generate the (empty) footer of a static page."""
+    return ""
@@ -2,8 +2,9 @@
 I contain the definition of the SemWiki service.
 """
 from contextlib import contextmanager
+from threading import RLock
 from rdflib import BNode, Graph, Literal, RDF, URIRef, XSD
-from rdflib.compare import graph_diff, isomorphic
+from rdflib.compare import isomorphic
 from rdfrest.exceptions import InvalidDataError, InvalidParametersError, \
     MethodNotAllowedError, RdfRestException
 from rdfrest.local import ILocalResource, Service, StandaloneResource
@@ -11,29 +12,161 @@ from rdfrest.mixins import WithCardinalityMixin, WithReservedNamespacesMixin, \
     WithTypedPropertiesMixin
 from rdfrest.utils import Diagnosis
 
+from .facets import FacetIndex, Facets
 from .format import add_triples, ban_triples, make_initial_value, \
     wikitext_to_triples
+from .hooks import HOOKS
+from .report import LinkReport, Report, topic_links
 from .namespace import SW
 
 class SemWikiService(Service):
     """I specialise Service by returning Topic for every relevant URI.
+
+    If `changelog` is provided (see `.replication.ChangeLog`), every edit
+    committed on a topic is recorded in it.
+
+    If `history` is provided (see `.history.RevisionStore`), every state of
+    every topic is recorded in it, and can be retrieved with the ``rev``
+    parameter.
+
+    Every edit is also submitted to the pre-commit and post-commit hooks of
+    `hooks` (see `.hooks.HookRegistry`, defaults to `.hooks.HOOKS`, where
+    plugins register their hooks).
+
+    I also maintain derived information about all topics, served by
+    read-only resources (see `DERIVED_RESOURCES`):
+
+    * `facets` indexes the typed values of semantic links (see `.facets`);
+    * `links` keeps track of the links between topics (see `.report`).
+
+    Building them requires to scan the whole store, so tools that only read
+    the topics (such as `.export`) can disable them with `index=False`; the
+    derived resources are then not available.
+
+    I also keep track of a revision number for each topic, which is
+    incremented every time the topic is changed (see `get_revision`).
+
+    Concurrent accesses are controlled by two kinds of locks:
+
+    * `topic_lock` returns a per-topic lock, held by `Topic.edit` for the
+      whole read-reconcile-commit sequence, so that edits of different topics
+      can proceed in parallel;
+    * `store_lock` is held for the (short) accesses of SemWiki to the store:
+      when filling the state of a topic, when committing an edit (or a
+      replicated state, see `.replication`), and when `get` looks up a
+      resource, so that readers never see a partially committed topic.
+      NB: the root resource is implemented by rdfrest, whose own accesses
+      to the store (e.g. when the root is edited) do not take that lock.
     """
     # too few public methods (1/2) #pylint: disable=R0903
-    def __init__(self, uri, store, create):
+
+    TOPIC_LOCKS = 64
+    DERIVED_RESOURCES = {
+        "@facets": Facets,
+        "@report": Report,
+    }
+
+    def __init__(self, uri, store, create, changelog=None, history=None,
+                 hooks=None, index=True):
+        self.store_lock = RLock()
+        self._topic_locks = [ RLock() for _ in range(self.TOPIC_LOCKS) ]
         init_service = create and init_semwiki
         Service.__init__(self, uri, store, [SemWiki], init_service)
+        self.changelog = changelog
+        self.history = history
+        if hooks is None:
+            hooks = HOOKS
+        self.hooks = hooks
+        self._revisions = {}
+        if index:
+            self.facets = FacetIndex()
+            self.links = LinkReport()
+            self._index_topics()
+        else:
+            self.facets = self.links = None
 
     def get(self, uri, _rdf_type=None, _no_spawn=False):
         """I return a Topic for all resources 
         """
-        ret = super(SemWikiService, self).get(uri, _rdf_type, _no_spawn)
-        if ret is None \
-                and uri.startswith(self.root_uri) \
-                and len(uri) > len(self.root_uri) \
-                and uri[len(self.root_uri)] != '@':
-            return Topic(uri, self)
-        else:
-            return ret
+        with self.store_lock:
+            ret = super(SemWikiService, self).get(uri, _rdf_type, _no_spawn)
+        if ret is None and uri.startswith(self.root_uri):
+            if self.is_topic_uri(uri):
+                return Topic(uri, self)
+            derived = self.DERIVED_RESOURCES.get(uri[len(self.root_uri):])
+            if derived is not None and self.facets is not None:
+                return derived(uri, self)
+        return ret
+
+    def is_topic_uri(self, uri):
+        """Return True if `uri` identifies a topic of this SemWiki.
+        """
+        root_uri = self.root_uri
+        return uri.startswith(root_uri) \
+            and len(uri) > len(root_uri) \
+            and uri[len(root_uri)] != '@'
+
+    def topic_lock(self, uri):
+        """Return the lock protecting the edition of topic `uri`.
+
+        Locks are striped over a fixed number of re-entrant locks, so that
+        memory usage does not grow with the number of topics.
+        """
+        return self._topic_locks[hash(unicode(uri)) % self.TOPIC_LOCKS]
+
+    def get_revision(self, uri):
+        """Return the revision number of topic `uri`.
+
+        Revision numbers are only meaningful for the lifetime of this object:
+        they start at 0 for every topic, and are incremented by
+        `topic_changed`. They can therefore be used as cache keys.
+        """
+        return self._revisions.get(uri, 0)
+
+    def topic_changed(self, uri, state, added=None, removed=None):
+        """I must be called every time the stored state of topic `uri` is
+        changed to `state`, while holding ``topic_lock(uri)``.
+
+        If the triples `added` to and `removed` from the previous state are
+        given, the derived information is updated from them only, rather than
+        from the whole state.
+        """
+        revision = self._revisions[uri] = self._revisions.get(uri, 0) + 1
+        changelog = self.changelog
+        if changelog is not None:
+            changelog.append(uri, state)
+        history = self.history
+        if history is not None:
+            history.record(uri, state)
+        if self.facets is not None:
+            if added is None:
+                self.facets.update(uri, state)
+                self.links.update(uri, len(state) > 0,
+                                  topic_links(self, state))
+            else:
+                self.facets.change(uri, added, removed)
+                self.links.change(uri, len(state) > 0,
+                                  topic_links(self, added),
+                                  topic_links(self, removed))
+        self.hooks.post_commit(self, uri, revision, state)
+
+    def _index_topics(self):
+        """I build the derived information about the topics in the store.
+        """
+        triples = {}
+        homes = []
+        with self.store_lock:
+            for triple in Graph(self.store, self.root_uri):
+                if self.is_topic_uri(triple[0]):
+                    triples.setdefault(triple[0], []).append(triple)
+                elif triple[0] == self.root_uri and triple[1] == SW.home:
+                    homes.append(triple[2])
+        # the home page is linked by the wiki itself
+        self.links.update(self.root_uri, False, homes)
+        for uri, topic_triples in triples.iteritems():
+            self.facets.update(uri, topic_triples)
+            self.links.update(uri, True,
+                              topic_links(self, topic_triples))
 
 def init_semwiki(service):
     """I initiatlize the store of `service`.
@@ -64,6 +197,9 @@ class _TopicBase(ILocalResource):
         self.service = service
         self._graph = Graph(service.store, service.root_uri)
         self._state = Graph(identifier=uri)
+        # NB: the revision is read *before* filling the state, so that the
+        # state is never older than self._revision
+        self._revision = service.get_revision(uri)
         self._fill_state(self._state)
 
     ######## Specific API  ########
@@ -76,8 +212,8 @@ class _TopicBase(ILocalResource):
     def set_wikitext(self, value):
         """Set this topic's wikitext.
         """
-        with self.edit() as editable:
-            editable.set(self.uri, SW.wikitext, Literal(value))
+        with self.edit(clear=True) as editable:
+            editable.add((self.uri, SW.wikitext, Literal(value)))
 
     wikitext = property(get_wikitext, set_wikitext)
 
@@ -94,8 +230,18 @@ class _TopicBase(ILocalResource):
         """I implement `.interface.IResource.get_state`.
 
         I return the subgraph of the semantic wiki representing this topic.
+
+        If parameter ``rev`` is provided, I return that revision of this
+        topic instead (see `.history.RevisionStore`).
         """
         self.check_parameters(parameters, "get_state")
+        if parameters is not None:
+            try:
+                return self.service.history.get(self.uri,
+                                                int(parameters["rev"]))
+            except (KeyError, ValueError):
+                raise InvalidParametersError("No such revision: %s"
+                                             % parameters["rev"])
         return self._state
 
     def force_state_refresh(self, parameters=None):
@@ -104,6 +250,7 @@ class _TopicBase(ILocalResource):
         # nothing to do, there is no cache involved
         self.check_parameters(parameters, "force_state_refresh")
         if self._state is not None:
+            self._revision = self.service.get_revision(self.uri)
             self._state.remove((None, None, None))
             self._fill_state(self._state)
         return
@@ -114,28 +261,62 @@ class _TopicBase(ILocalResource):
 
         I do not support _trust nor embeded edit contexts (at least for the
         moment).
+
+        The topic lock is held during the whole edit context, so concurrent
+        edits of the same topic are serialized, and the edited graph always
+        starts from the latest committed state.
+
+        Pre-commit hooks are called once the new graph has been checked (see
+        `.hooks`).
         """
         # unused arguments #pylint: disable=W0613
         self.check_parameters(parameters, "edit")
-        editable = Graph()
-        if not clear:
-            editable_add = editable.add
-            for t in self._state:
-                editable_add(t)
-
-        yield editable
-        self.complete_new_graph(self.service, self.uri, parameters,
-                                editable, self)
-        diag = self.check_new_graph(self.service, self.uri, parameters,
+        service = self.service
+        with service.topic_lock(self.uri):
+            # another thread may have committed since our state was filled
+            if self._revision != service.get_revision(self.uri):
+                self.force_state_refresh()
+            editable = Graph()
+            if not clear:
+                editable_add = editable.add
+                for t in self._state:
+                    editable_add(t)
+
+            yield editable
+            self.complete_new_graph(service, self.uri, parameters,
                                     editable, self)
-        if not diag:
-            raise InvalidDataError(unicode(diag))
-            
-        self._graph.remove((self.uri, None, None))
-        graph_add = self._graph.add
-        for t in editable:
-            graph_add(t)
-        self.force_state_refresh()
+            added, removed = _diff(editable, self._state)
+            diag = self.check_new_graph(service, self.uri, parameters,
+                                        editable, self, added, removed)
+            if not diag:
+                raise InvalidDataError(unicode(diag))
+            service.hooks.pre_commit(self, editable)
+
+            # only the changed triples are written, as the state reflects the
+            # store (the topic lock is held)... unless the topic is not stored
+            # yet, as the state then holds its initial value
+            with service.store_lock:
+                graph = self._graph
+                if self._stored:
+                    for t in removed:
+                        graph.remove(t)
+                    for t in added:
+                        graph.add(t)
+                else:
+                    for t in editable:
+                        graph.add(t)
+            state = self._state
+            for t in removed:
+                state.remove(t)
+            for t in added:
+                state.add(t)
+            if self._stored:
+                service.topic_changed(self.uri, state, added, removed)
+            else:
+                # the initial value was never indexed
+                self._stored = True
+                service.topic_changed(self.uri, state)
+            self._revision = service.get_revision(self.uri)
         
     def post_graph(self, graph, parameters=None,
                    _trust=False, _created=None, _rdf_type=None):
@@ -160,16 +341,21 @@ class _TopicBase(ILocalResource):
     def check_parameters(self, parameters, method):
         """I implement :meth:`ILocalResource.check_parameters`.
 
-        I accepts no parameter (not even an empty query string).
+        I accepts no parameter (not even an empty query string), except
+        ``rev`` (once) for get_state if the service keeps an history.
         """
-        # self is not used #pylint: disable=R0201
-        # argument 'method' is not used #pylint: disable=W0613
-
         # Do NOT call super method, as this is the base implementation.
         if parameters is not None:
             if not parameters:
                 raise InvalidParametersError("Unsupported parameters "
                                              "(empty dict instead of None)")
+            elif method == "get_state" \
+                    and self.service.history is not None \
+                    and parameters.keys() == ["rev"]:
+                if isinstance(parameters["rev"], list):
+                    raise InvalidParametersError("Parameter rev can not be "
+                                                 "repeated")
+                return
             else:
                 raise InvalidParametersError("Unsupported parameter(s):" +
                                              ", ".join(parameters.keys()))
@@ -221,7 +407,7 @@ class _TopicBase(ILocalResource):
             old_wikitext = resource.get_state().value(uri, SW.wikitext)
             new_graph.add((uri, SW.wikitext, old_wikitext))
             new_wikitext = unicode(old_wikitext)
-        _, added, removed = graph_diff(new_graph, resource.get_state())
+        added, removed = _diff(new_graph, resource.get_state())
         if added:
             new_wikitext = add_triples(resource, new_wikitext, added)
         if removed:
@@ -266,15 +452,30 @@ class _TopicBase(ILocalResource):
     def _fill_state(self, state):
         """I fill the state with relevant triple.
 
-        I also create user-friendly triples if resource does not exist.
+        I also create user-friendly triples if resource does not exist
+        (which is recorded in self._stored).
         """
         add = state.add
-        for t in self._graph.triples((self.uri, None, None)):
-            add(t)
-        if len(state) == 0:
+        with self.service.store_lock:
+            for t in self._graph.triples((self.uri, None, None)):
+                add(t)
+        self._stored = len(state) > 0
+        if not self._stored:
             add((self.uri, SW.wikitext, Literal(make_initial_value(self))))
 
 
+def _diff(new_graph, old_graph):
+    """Return the triples added to and removed from `old_graph` (as lists).
+
+    As topics contain no blank node, this is a plain set difference, which
+    is much cheaper than `rdflib.compare.graph_diff`. Triples are sorted, so
+    that the wikitext generated from them is deterministic.
+    """
+    new_triples = set(new_graph)
+    old_triples = set(old_graph)
+    return sorted(new_triples - old_triples), sorted(old_triples - new_triples)
+
+
 class Topic(WithCardinalityMixin, WithReservedNamespacesMixin,
             WithTypedPropertiesMixin, _TopicBase):
     """
@@ -1,17 +1,36 @@
 """
 This is a standalone version of an HTTP-based SemWiki.
 """
+import atexit
+from collections import deque, OrderedDict
+from gzip import GzipFile
+from json import dumps
 import logging
 from optparse import OptionParser, OptionGroup
-from os.path import exists
-from rdflib import plugin as rdflib_plugin
+from os.path import exists, join
+from shelve import open as shelve_open
+from shutil import rmtree
+from rdflib import plugin as rdflib_plugin, URIRef
 from rdflib.store import Store
-from rdfrest.http_server import HttpFrontend
+from rdfrest.http_server import HttpFrontend, MyRequest
 from rdfrest.serializers import bind_prefix, get_prefix_bindings
-from socket import getaddrinfo, AF_INET6, AF_INET, SOCK_STREAM
-from wsgiref.simple_server import WSGIServer, make_server
+from rdfrest.utils import extsplit
+from socket import error as socket_error, getaddrinfo, timeout as \
+    socket_timeout, AF_INET6, AF_INET, IPPROTO_TCP, SOCK_STREAM, TCP_NODELAY
+from StringIO import StringIO
+from SocketServer import ThreadingMixIn
+from tempfile import mkdtemp
+from threading import Event, Lock
+from time import time
+from wsgiref.simple_server import make_server, ServerHandler, WSGIServer, \
+    WSGIRequestHandler
 
+from .history import RevisionStore
+from .hooks import HOOKS
+from .hybrid import HybridStore
 from .namespace import SW
+from .replication import ChangeLog, ChangeLogPublisher, ReplicaFollower, \
+    ReplicaFrontend
 from .service import SemWikiService
 
 OPTIONS = None
@@ -26,6 +45,8 @@ def main():
     log_level = getattr(logging, OPTIONS.log_level.upper())
     logging.basicConfig(level=log_level) # configure logging
 
+    HOOKS.configure(OPTIONS.hook_workers, OPTIONS.hook_queue_size,
+                    OPTIONS.hook_put_timeout)
     for plugin_name in OPTIONS.plugin or ():
         try:
             plugin = __import__(plugin_name, fromlist="start_plugin")
@@ -35,36 +56,70 @@ def main():
         plugin.start_plugin()
     uri = "http://%(host_name)s:%(port)s%(base_path)s/" % OPTIONS.__dict__
 
-    repository = OPTIONS.repository
-    if repository is None:
-        create = True
-        repository = ":IOMemory:"
-    elif repository[0] != ":":
-        create = not exists(repository)
-        repository = ":Sleepycat:%s" % repository
-    _, store_type, config_str = repository.split(":", 2)
-    store = rdflib_plugin.get(store_type, Store)(config_str)
-    sw_service = SemWikiService(uri, store, create)
+    store, create = make_store(OPTIONS.repository,
+                               OPTIONS.max_resident_triples)
+    if OPTIONS.replica_of or not OPTIONS.changelog_size:
+        changelog = None
+    else:
+        changelog = ChangeLog(OPTIONS.changelog_size)
+    if OPTIONS.history_file:
+        storage = shelve_open(OPTIONS.history_file)
+        atexit.register(storage.close)
+        history = RevisionStore(storage, OPTIONS.history_snapshots)
+    elif OPTIONS.history:
+        history = RevisionStore(None, OPTIONS.history_snapshots)
+    else:
+        history = None
+    sw_service = SemWikiService(uri, store, create, changelog, history)
 
     wsgifront_options = {}
     if OPTIONS.no_cache:
         wsgifront_options["cache_control"] = (lambda x: None)
     application = HttpFrontend(sw_service, **wsgifront_options)
+    if changelog is not None:
+        application = ChangeLogPublisher(application, sw_service,
+                                         OPTIONS.base_path + "/@changes")
+    if OPTIONS.replica_of:
+        primary_uri = OPTIONS.replica_of
+        if not primary_uri.endswith("/"):
+            primary_uri += "/"
+        follower = ReplicaFollower(sw_service, primary_uri,
+                                   OPTIONS.replica_interval)
+        follower.start()
+        application = ReplicaFrontend(application, follower,
+                                      OPTIONS.replica_forward,
+                                      OPTIONS.base_path + "/@replication")
+        LOG.info("Replicating %s" % primary_uri)
+    application = StatsPublisher(application, HOOKS.get_stats,
+                                 OPTIONS.base_path + "/@hooks")
+    if isinstance(store, HybridStore):
+        application = StatsPublisher(application, store.get_stats,
+                                     OPTIONS.base_path + "/@store")
+    if not OPTIONS.no_gzip:
+        application = GzipCompressor(application, sw_service,
+                                     cache_size=OPTIONS.gzip_cache << 20)
     if OPTIONS.flash_allow:
         application = FlashAllower(application)
+    if OPTIONS.threaded or OPTIONS.keep_alive:
+        application = AdmissionController(application,
+                                          OPTIONS.max_readers,
+                                          OPTIONS.max_writers,
+                                          OPTIONS.queue_size,
+                                          OPTIONS.queue_timeout,
+                                          OPTIONS.base_path + "/@admission")
+        server_class = ThreadingWSGIServer
+    else:
+        server_class = MyWSGIServer
+    if OPTIONS.keep_alive:
+        handler_class = KeepAliveRequestHandler
+    else:
+        handler_class = WSGIRequestHandler
 
-    for nsprefix in OPTIONS.ns_prefix or ():
-        prefix, uri = nsprefix.split(1)
-        bind_prefix(prefix, uri)
-    prefix_bindings = get_prefix_bindings()
-    for prefix in ["", "sw", "semwiki", "semwikins"]:
-        if prefix not in prefix_bindings:
-            bind_prefix(prefix, SW)
-            break
-
+    bind_prefixes(OPTIONS.ns_prefix)
 
     httpd = make_server(OPTIONS.host_name, OPTIONS.port, application,
-                        MyWSGIServer)
+                        server_class, handler_class)
+    httpd.keep_alive_timeout = OPTIONS.keep_alive_timeout
     LOG.info("SemWiki server at %s" % uri)
     requests = OPTIONS.requests
     if requests == -1:
@@ -75,6 +130,56 @@ def main():
             requests -= 1
 
 
+def make_store(repository, max_resident_triples=None):
+    """I open the RDF store identified by `repository`.
+
+    `repository` is either None (for an in-memory store), a filename (for a
+    Sleepycat store) or a string of the form ``:StoreType:config_str``.
+
+    If `max_resident_triples` is provided, that store is wrapped in a
+    write-through `HybridStore` keeping at most that number of triples in
+    memory; an in-memory store is then replaced by a Sleepycat store in a
+    temporary directory, so that cold topics are spilled on disk.
+
+    :return: a tuple (store, create) where `create` indicates whether the
+             store needs to be initialized
+    """
+    if max_resident_triples:
+        if repository is None:
+            tmpdir = mkdtemp(prefix="semwiki-")
+            atexit.register(rmtree, tmpdir, True)
+            repository = join(tmpdir, "store")
+        cold, create = make_store(repository)
+        return HybridStore(cold, max_resident_triples), create
+    create = None
+    if repository is None:
+        create = True
+        repository = ":IOMemory:"
+    elif repository[0] != ":":
+        create = not exists(repository)
+        repository = ":Sleepycat:%s" % repository
+    _, store_type, config_str = repository.split(":", 2)
+    store = rdflib_plugin.get(store_type, Store)(config_str)
+    if create is None:
+        # explicit store type: initialize it if it is empty
+        create = len(store) == 0
+    return store, create
+
+def bind_prefixes(ns_prefixes=None):
+    """I bind the namespace prefixes used by serializers.
+
+    `ns_prefixes` is a list of declarations of the form 'prefix:uri'; the
+    SemWiki namespace is also bound to the first free prefix.
+    """
+    for nsprefix in ns_prefixes or ():
+        prefix, ns_uri = nsprefix.split(":", 1)
+        bind_prefix(prefix, ns_uri)
+    prefix_bindings = get_prefix_bindings()
+    for prefix in ["", "sw", "semwiki", "semwikins"]:
+        if prefix not in prefix_bindings:
+            bind_prefix(prefix, SW)
+            break
+
 def parse_options():
     """I parse sys.argv for the main.
     """
@@ -100,11 +205,83 @@ def parse_options():
                    help="prevent SemWiki to send cache-control directives")
     ogr.add_option("-F", "--flash-allow", action="store_true",
                    help="serve a policy file allowing Flash applets to connect")
+    ogr.add_option("-z", "--no-gzip", action="store_true", default=False,
+                   help="never compress responses")
+    ogr.add_option("--gzip-cache", default=16, type=int,
+                   help="the size (in MB) of the cache of compressed "
+                        "responses (default: 16)")
+    ogr.add_option("-M", "--max-resident-triples", type=int,
+                   help="keep the triples of the most recently used topics "
+                        "in memory, up to that number of triples (not "
+                        "bytes); all triples are written through to disk "
+                        "(statistics are served at @store)")
     ogr.add_option("-T", "--max-triples",
                    help="sets the maximum number of bytes of payloads"
                    "(no limit if unset)")
     opt.add_option_group(ogr)
 
+    ogr = OptionGroup(opt, "Concurrency options")
+    ogr.add_option("-t", "--threaded", action="store_true", default=False,
+                   help="serve requests in parallel threads, with admission "
+                        "control (statistics are served at @admission)")
+    ogr.add_option("-k", "--keep-alive", action="store_true", default=False,
+                   help="support HTTP/1.1 persistent connections "
+                        "(implies --threaded)")
+    ogr.add_option("--keep-alive-timeout", default=15.0, type=float,
+                   help="the time (in seconds) after which an idle "
+                        "persistent connection is closed (default: 15)")
+    ogr.add_option("--max-readers", default=8, type=int,
+                   help="the maximum number of concurrent read requests "
+                        "(default: 8)")
+    ogr.add_option("--max-writers", default=2, type=int,
+                   help="the maximum number of concurrent write requests "
+                        "(default: 2)")
+    ogr.add_option("--queue-size", default=64, type=int,
+                   help="the maximum number of requests waiting for "
+                        "admission, for reads and writes each (default: 64)")
+    ogr.add_option("--queue-timeout", default=10.0, type=float,
+                   help="the maximum time (in seconds) a request waits for "
+                        "admission (default: 10)")
+    opt.add_option_group(ogr)
+
+    ogr = OptionGroup(opt, "Plugin options")
+    ogr.add_option("--hook-workers", default=2, type=int,
+                   help="the number of threads running post-commit hooks "
+                        "(default: 2)")
+    ogr.add_option("--hook-queue-size", default=1000, type=int,
+                   help="the number of pending edit events per thread, "
+                        "beyond which events are dropped (default: 1000)")
+    ogr.add_option("--hook-put-timeout", default=0.0, type=float,
+                   help="the maximum time (in seconds) an edit waits for "
+                        "room in a full queue before its event is dropped "
+                        "(default: 0, i.e. drop immediately); statistics "
+                        "are served at @hooks")
+    opt.add_option_group(ogr)
+
+    ogr = OptionGroup(opt, "History options")
+    ogr.add_option("--history", action="store_true", default=False,
+                   help="keep the history of topics in memory")
+    ogr.add_option("--history-file",
+                   help="keep the history of topics in the given file")
+    ogr.add_option("--history-snapshots", default=16, type=int,
+                   help="the number of revisions between two full snapshots "
+                        "(default: 16)")
+    opt.add_option_group(ogr)
+
+    ogr = OptionGroup(opt, "Replication options")
+    ogr.add_option("--replica-of", metavar="URI",
+                   help="run as a read-only replica of the SemWiki at URI")
+    ogr.add_option("--replica-interval", default=1.0, type=float,
+                   help="the delay (in seconds) between two polls of the "
+                        "primary (default: 1)")
+    ogr.add_option("--replica-forward", action="store_true", default=False,
+                   help="forward write requests to the primary instead of "
+                        "rejecting them")
+    ogr.add_option("--changelog-size", default=10000, type=int,
+                   help="the number of edits kept for replicas "
+                        "(default: 10000, 0 disables the change log)")
+    opt.add_option_group(ogr)
+
     ogr = OptionGroup(opt, "Debug options")
     ogr.add_option("-l", "--log-level", default="info",
                    choices=["debug", "info", "warning", "error", "critical"],
@@ -146,6 +323,204 @@ class MyWSGIServer(WSGIServer):
         LOG.info("Using IPV%s" % {AF_INET: 4, AF_INET6: 6}[ipv])
         WSGIServer.__init__(self, (host, port), handler_class)
 
+class ThreadingWSGIServer(ThreadingMixIn, MyWSGIServer):
+    """
+    I override MyWSGIServer to handle each request in a separate thread.
+    """
+    daemon_threads = True
+
+class KeepAliveRequestHandler(WSGIRequestHandler):
+    """
+    I override WSGIRequestHandler to support HTTP/1.1 persistent connections.
+
+    Several requests (possibly pipelined) are served on the same connection,
+    until the client asks to close it or stays idle more than `timeout`
+    seconds. Responses without a Content-Length are sent with the chunked
+    transfer-coding to HTTP/1.1 clients; for HTTP/1.0 clients, the
+    connection is then closed after the response.
+
+    As an idle connection keeps its thread busy, this should be used with
+    ThreadingWSGIServer. The server may override `timeout` with its own
+    `keep_alive_timeout` attribute.
+    """
+    protocol_version = "HTTP/1.1"
+    timeout = 15
+    wbufsize = -1 # send every response in as few segments as possible
+    max_drained = 1 << 16 # larger unread request bodies close the connection
+
+    def setup(self):
+        self.timeout = getattr(self.server, "keep_alive_timeout",
+                               self.timeout)
+        WSGIRequestHandler.setup(self)
+        try:
+            self.connection.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)
+        except socket_error:
+            pass # e.g. not a TCP socket
+
+    def handle(self):
+        """Handle requests until the connection must be closed"""
+        self.close_connection = 1
+        self.handle_one_request()
+        while not self.close_connection:
+            self.handle_one_request()
+
+    def handle_one_request(self):
+        """Handle a single HTTP request"""
+        try:
+            self.raw_requestline = self.rfile.readline(65537)
+        except socket_timeout:
+            self.close_connection = 1 # idle for too long
+            return
+        if not self.raw_requestline:
+            self.close_connection = 1 # closed by the client
+            return
+        try:
+            if len(self.raw_requestline) > 65536:
+                self.requestline = ''
+                self.request_version = ''
+                self.command = ''
+                self.send_error(414)
+                self.close_connection = 1
+                return
+            if not self.parse_request(): # an error code has been sent
+                return
+            self._serve_request()
+        finally:
+            try:
+                self.wfile.flush()
+            except socket_error:
+                # the client is gone (e.g. EPIPE); this must not mask the
+                # exception raised by the application, if any
+                self.close_connection = 1
+
+    def _serve_request(self):
+        """Run the application once the request line and headers are parsed
+        """
+        if "chunked" in self.headers.getheader("transfer-encoding", ""):
+            # chunked request bodies are not supported by wsgiref: the
+            # application sees an empty body, and we can not find where the
+            # next request starts
+            length = 0
+            self.close_connection = 1
+        else:
+            try:
+                length = int(self.headers.getheader("content-length", 0))
+                if length < 0:
+                    raise ValueError(length)
+            except ValueError:
+                self.send_error(400, "Bad Content-Length")
+                self.close_connection = 1
+                return
+        stdin = _BoundedInput(self.rfile, length)
+        handler = _KeepAliveServerHandler(
+            stdin, self.wfile, self.get_stderr(), self.get_environ()
+        )
+        handler.request_handler = self      # backpointer for logging
+        handler.run(self.server.get_app())
+        if not self.close_connection and not stdin.drain(self.max_drained):
+            self.close_connection = 1
+
+class _KeepAliveServerHandler(ServerHandler):
+    """I frame WSGI responses for KeepAliveRequestHandler.
+    """
+    http_version = "1.1"
+    _chunked = False
+    _no_body = False
+
+    def cleanup_headers(self):
+        ServerHandler.cleanup_headers(self)
+        request_handler = self.request_handler
+        code = self.status[:3]
+        self._no_body = (self.environ["REQUEST_METHOD"] == "HEAD"
+                         or code[0] == "1" or code in ("204", "304"))
+        http11 = self.environ["SERVER_PROTOCOL"] == "HTTP/1.1"
+        if "Content-Length" not in self.headers and not self._no_body:
+            if http11 and not request_handler.close_connection:
+                self.headers["Transfer-Encoding"] = "chunked"
+                self._chunked = True
+            else:
+                # the end of the body can only be signaled by closing
+                request_handler.close_connection = 1
+        if request_handler.close_connection:
+            self.headers["Connection"] = "close"
+        elif not http11:
+            self.headers["Connection"] = "keep-alive"
+
+    def write(self, data):
+        assert type(data) is str, "write() argument must be string"
+        if not self.status:
+            raise AssertionError("write() before start_response()")
+        elif not self.headers_sent:
+            # Before the first output, send the stored headers
+            self.bytes_sent = len(data)    # make sure we know content-length
+            self.send_headers()
+        else:
+            self.bytes_sent += len(data)
+        if self._no_body or not data:
+            return # NB: an empty chunk would end the body
+        if self._chunked:
+            data = "%x\r\n%s\r\n" % (len(data), data)
+        self._write(data)
+        self._flush()
+
+    def finish_content(self):
+        if not self.headers_sent:
+            ServerHandler.finish_content(self)
+        elif self._chunked:
+            self._write("0\r\n\r\n")
+            self._flush()
+
+    def handle_error(self):
+        if self.headers_sent:
+            # the response is truncated, so the client must be told
+            self.request_handler.close_connection = 1
+        ServerHandler.handle_error(self)
+
+class _BoundedInput(object):
+    """I wrap the input stream of a connection, in order to prevent the
+    application from reading beyond the body of the current request.
+    """
+
+    def __init__(self, rfile, length):
+        self.rfile = rfile
+        self.remaining = length
+
+    def read(self, size=-1):
+        """Read at most `size` bytes of the body (all if negative)"""
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.rfile.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def readline(self, size=-1):
+        """Read one line of the body"""
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.rfile.readline(size)
+        self.remaining -= len(data)
+        return data
+
+    def readlines(self, hint=-1):
+        """Read all the lines of the body"""
+        # NB: hint is ignored #pylint: disable=W0613
+        return list(self)
+
+    def __iter__(self):
+        return iter(self.readline, "")
+
+    def drain(self, limit):
+        """Skip the unread part of the body, if no larger than `limit`.
+
+        :return: True if the input is now at the end of the body
+        """
+        if self.remaining > limit:
+            return False
+        while self.remaining:
+            if not self.read(min(self.remaining, 8192)):
+                return False # closed by the client
+        return True
+
 class NoCache(object):
     """
     A strawman cache doing no real caching, used for debugging.
@@ -194,3 +569,391 @@ class FlashAllower(object):
             return [self.xml]
         else:
             return self.app(env, start_response)
+
+
+class StatsPublisher(object):
+    """
+    I wrap a WSGI application in order to serve some statistics as JSON.
+    """
+    #pylint: disable-msg=R0903
+    #    too few public methods
+
+    def __init__(self, app, get_stats, path):
+        """
+        * app: the wrapped WSGI application
+        * get_stats: a function returning the statistics as a dict
+        * path: the path where statistics are served
+        """
+        self.app = app
+        self.get_stats = get_stats
+        self.path = path
+
+    def __call__(self, env, start_response):
+        if env["PATH_INFO"] == self.path:
+            body = dumps(self.get_stats())
+            start_response("200 OK", [
+                ("content-type", "application/json"),
+                ("content-length", str(len(body))),
+                ("cache-control", "no-cache"),
+            ])
+            return [body]
+        else:
+            return self.app(env, start_response)
+
+
+class GzipCompressor(object):
+    """
+    I wrap a WSGI application in order to gzip its responses when possible.
+
+    Compressed topic representations are cached, with their revision number
+    and content-type as a key, so that a given version of a page is only
+    compressed once. Furthermore, on a cache hit, the wrapped application's
+    response body is not even consumed, which spares its serialization.
+    """
+    #pylint: disable-msg=R0903
+    #    too few public methods
+
+    COMPRESSIBLE = ("text/", "application/json", "application/javascript",
+                    "application/xml", "application/rdf+xml",
+                    "application/turtle", "application/x-turtle")
+
+    def __init__(self, app, service, min_size=512, cache_size=16<<20,
+                 level=6):
+        """
+        * app: the wrapped WSGI application
+        * service: the SemWikiService served by app
+        * min_size: responses smaller than that are not compressed
+        * cache_size: the maximum number of bytes kept in the cache
+        * level: the gzip compression level
+        """
+        self.app = app
+        self.service = service
+        self.min_size = min_size
+        self.cache_size = cache_size
+        self.level = level
+        self._cache = OrderedDict()
+        self._cached_bytes = 0
+        self._lock = Lock()
+
+    def __call__(self, env, start_response):
+        if env["REQUEST_METHOD"] != "GET" \
+                or not accepts_gzip(env.get("HTTP_ACCEPT_ENCODING", "")):
+            def vary_start_response(status, headers, exc_info=None):
+                "Add 'Accept-Encoding' to the Vary header field"
+                return start_response(status, add_vary(headers), exc_info)
+            return self.app(env, vary_start_response)
+
+        # the revision must be read *before* the response is produced:
+        # a concurrent edit may then cause a response to be cached under an
+        # outdated key, which is harmless, while the opposite would not be
+        key_base = None
+        if not env.get("QUERY_STRING"):
+            uri = URIRef(extsplit(MyRequest(env).path_url)[0])
+            if self.service.is_topic_uri(uri):
+                key_base = (uri, self.service.get_revision(uri))
+
+        captured = []
+        def capture_start_response(status, headers, exc_info=None):
+            "Capture status and headers until the body is known"
+            if exc_info is not None and captured:
+                raise exc_info[0], exc_info[1], exc_info[2]
+            captured[:] = [status, headers]
+            return _no_write
+        result = self.app(env, capture_start_response)
+        if not captured:
+            # start_response may be delayed until the first chunk is produced
+            result = list(result)
+        status, headers = captured
+
+        ctype = None
+        for key, value in headers:
+            lkey = key.lower()
+            if lkey == "content-type":
+                ctype = value
+            elif lkey == "content-encoding":
+                ctype = None # already encoded
+                break
+        if not status.startswith("200") or ctype is None \
+                or not ctype.startswith(self.COMPRESSIBLE):
+            start_response(status, add_vary(headers))
+            return result
+
+        compressed = None
+        if key_base is not None:
+            key = key_base + (ctype,)
+            with self._lock:
+                compressed = self._cache.pop(key, None)
+                if compressed is not None:
+                    self._cache[key] = compressed # most recently used
+        if compressed is not None:
+            close = getattr(result, "close", None)
+            if close is not None:
+                close()
+        else:
+            try:
+                body = "".join(result)
+            finally:
+                close = getattr(result, "close", None)
+                if close is not None:
+                    close()
+            if len(body) < self.min_size:
+                headers = [ (k, v) for k, v in headers
+                            if k.lower() != "content-length" ]
+                headers.append(("content-length", str(len(body))))
+                start_response(status, add_vary(headers))
+                return [body]
+            compressed = gzip_string(body, self.level)
+            if key_base is not None:
+                self._store(key, compressed)
+
+        headers = [ (k, v) for k, v in headers
+                    if k.lower() != "content-length" ]
+        headers.append(("content-encoding", "gzip"))
+        headers.append(("content-length", str(len(compressed))))
+        start_response(status, add_vary(headers))
+        return [compressed]
+
+    def _store(self, key, compressed):
+        """Store `compressed` in the cache, evicting older entries if needed.
+        """
+        size = len(compressed)
+        if size > self.cache_size:
+            return
+        with self._lock:
+            old = self._cache.pop(key, None)
+            if old is not None:
+                self._cached_bytes -= len(old)
+            self._cache[key] = compressed
+            self._cached_bytes += size
+            while self._cached_bytes > self.cache_size:
+                _, evicted = self._cache.popitem(last=False)
+                self._cached_bytes -= len(evicted)
+
+def accepts_gzip(accept_encoding):
+    """Return True if the given Accept-Encoding header field allows gzip.
+    """
+    star = False
+    for item in accept_encoding.split(","):
+        parts = item.split(";")
+        coding = parts[0].strip().lower()
+        qvalue = 1.0
+        for param in parts[1:]:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    qvalue = float(value)
+                except ValueError:
+                    qvalue = 0.0
+        if coding in ("gzip", "x-gzip"):
+            return qvalue > 0
+        elif coding == "*":
+            star = qvalue > 0
+    return star
+
+def add_vary(headers):
+    """Return a copy of `headers` where Vary includes Accept-Encoding.
+    """
+    ret = []
+    vary = None
+    for key, value in headers:
+        if key.lower() == "vary":
+            vary = value
+        else:
+            ret.append((key, value))
+    if vary is None:
+        vary = "Accept-Encoding"
+    elif "accept-encoding" not in vary.lower():
+        vary = "%s, Accept-Encoding" % vary
+    ret.append(("vary", vary))
+    return ret
+
+def gzip_string(data, level=6):
+    """Return `data` compressed in the gzip format.
+    """
+    buf = StringIO()
+    gzfile = GzipFile(fileobj=buf, mode="wb", compresslevel=level, mtime=0)
+    try:
+        gzfile.write(data)
+    finally:
+        gzfile.close()
+    return buf.getvalue()
+
+def _no_write(_data):
+    """The write callable returned to applications by GzipCompressor.
+
+    Applications wrapped by GzipCompressor must return their body instead.
+    """
+    raise RuntimeError("the WSGI write() callable is not supported behind "
+                       "GzipCompressor")
+
+
+class AdmissionController(object):
+    """
+    I wrap a WSGI application in order to bound the number of requests it
+    processes concurrently.
+
+    Read requests (GET, HEAD, OPTIONS) and write requests have separate
+    concurrency limits. Requests exceeding that limit wait, in FIFO order, in
+    a bounded queue; when the queue is full, or when a request has waited too
+    long, a 503 response is issued with a Retry-After header field.
+
+    Statistics about queues and waiting times are served at `path`.
+    """
+    #pylint: disable-msg=R0903
+    #    too few public methods
+
+    READ_METHODS = frozenset(["GET", "HEAD", "OPTIONS"])
+
+    def __init__(self, app, max_readers=8, max_writers=2, queue_size=64,
+                 timeout=10.0, path="/@admission", retry_after=1):
+        """
+        * app: the wrapped WSGI application
+        * max_readers, max_writers: the concurrency limits
+        * queue_size: the maximum number of waiting reads, and of waiting
+          writes
+        * timeout: the maximum time (in seconds) a request waits in queue
+        * path: the path where statistics are served
+        * retry_after: the value of Retry-After in 503 responses
+        """
+        self.app = app
+        self.readers = _Gate("read", max_readers, queue_size, timeout)
+        self.writers = _Gate("write", max_writers, queue_size, timeout)
+        self.path = path
+        self.retry_after = str(retry_after)
+
+    def __call__(self, env, start_response):
+        if env["PATH_INFO"] == self.path:
+            body = dumps({
+                "read": self.readers.get_stats(),
+                "write": self.writers.get_stats(),
+            })
+            start_response("200 OK", [
+                ("content-type", "application/json"),
+                ("content-length", str(len(body))),
+                ("cache-control", "no-cache"),
+            ])
+            return [body]
+
+        if env["REQUEST_METHOD"] in self.READ_METHODS:
+            gate = self.readers
+        else:
+            gate = self.writers
+        if not gate.acquire():
+            msg = "503 Service Unavailable\nToo many %s requests" % gate.name
+            start_response("503 Service Unavailable", [
+                ("content-type", "text/plain"),
+                ("content-length", str(len(msg))),
+                ("retry-after", self.retry_after),
+            ])
+            return [msg]
+        try:
+            result = self.app(env, start_response)
+        except:
+            gate.release()
+            raise
+        return _ReleasingIterable(result, gate.release)
+
+class _Gate(object):
+    """I implement the admission policy of AdmissionController for one kind
+    of requests.
+    """
+
+    def __init__(self, name, limit, queue_size, timeout):
+        self.name = name
+        self.limit = limit
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self._lock = Lock()
+        self._active = 0
+        self._waiters = deque()
+        self._admitted = 0
+        self._queued = 0
+        self._rejected = 0
+        self._timed_out = 0
+        self._max_queue = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+
+    def acquire(self):
+        """Wait for a slot, and return whether one was obtained.
+        """
+        with self._lock:
+            if self._active < self.limit and not self._waiters:
+                self._active += 1
+                self._admitted += 1
+                return True
+            if len(self._waiters) >= self.queue_size:
+                self._rejected += 1
+                return False
+            event = Event()
+            self._waiters.append(event)
+            self._queued += 1
+            self._max_queue = max(self._max_queue, len(self._waiters))
+        start = time()
+        event.wait(self.timeout)
+        with self._lock:
+            # NB: the event can only be set while holding the lock
+            waited = time() - start
+            self._total_wait += waited
+            self._max_wait = max(self._max_wait, waited)
+            if not event.is_set():
+                self._waiters.remove(event)
+                self._timed_out += 1
+                return False
+            self._admitted += 1
+            return True
+
+    def release(self):
+        """Release a slot obtained with `acquire`.
+        """
+        with self._lock:
+            if self._waiters:
+                # hand the slot over to the first waiter
+                self._waiters.popleft().set()
+            else:
+                self._active -= 1
+
+    def get_stats(self):
+        """Return a dict of statistics about this gate.
+        """
+        with self._lock:
+            if self._queued:
+                mean_wait = self._total_wait / self._queued
+            else:
+                mean_wait = 0.0
+            return {
+                "limit": self.limit,
+                "active": self._active,
+                "queue_depth": len(self._waiters),
+                "max_queue_depth": self._max_queue,
+                "admitted": self._admitted,
+                "queued": self._queued,
+                "rejected": self._rejected,
+                "timed_out": self._timed_out,
+                "mean_wait": mean_wait,
+                "max_wait": self._max_wait,
+            }
+
+class _ReleasingIterable(object):
+    """I wrap a WSGI response in order to call `release` when it is closed.
+    """
+    #pylint: disable-msg=R0903
+    #    too few public methods
+
+    def __init__(self, result, release):
+        self.result = result
+        self.release = release
+
+    def __iter__(self):
+        return iter(self.result)
+
+    def close(self):
+        """Close the wrapped response, and release its slot."""
+        release, self.release = self.release, None
+        try:
+            close = getattr(self.result, "close", None)
+            if close is not None:
+                close()
+        finally:
+            if release is not None:
+                release()
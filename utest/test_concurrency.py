@@ -0,0 +1,83 @@
+from semwiki.service import SemWikiService
+from semwiki.namespace import SW
+
+from nose.tools import eq_
+from rdflib import Graph, Literal, URIRef
+from rdfrest.local import unregister_service
+from threading import Thread
+
+ROOT_URI = URIRef("http://localhost:8001/")
+COUNT = URIRef(ROOT_URI + "count")
+
+WRITERS = 8
+EDITS = 25
+SHARED = 3
+
+class TestConcurrentEdits():
+    def setUp(self):
+        self.service = SemWikiService(ROOT_URI, Graph().store, True)
+        self.errors = []
+
+    def tearDown(self):
+        unregister_service(self.service)
+        self.service = None
+
+    def increment(self, name):
+        """Increment the :count of the given topic"""
+        topic = self.service.get(URIRef(ROOT_URI + name))
+        with topic.edit() as editable:
+            count = editable.value(topic.uri, COUNT)
+            count = (count is not None) and count.toPython() or 0
+            editable.remove((None, None, None))
+            editable.add((topic.uri, SW.wikitext,
+                          Literal(":count->%s" % (count + 1))))
+
+    def writer(self, i):
+        try:
+            for j in range(EDITS):
+                self.increment("Own%s" % i) # disjoint
+                self.increment("Shared%s" % ((i + j) % SHARED)) # overlapping
+        except Exception, ex:
+            self.errors.append(ex)
+
+    def reader(self, done):
+        try:
+            while not done:
+                for i in range(SHARED):
+                    uri = URIRef(ROOT_URI + "Shared%s" % i)
+                    state = self.service.get(uri).get_state()
+                    wikitext = state.value(uri, SW.wikitext)
+                    count = state.value(uri, COUNT)
+                    if count is not None:
+                        # wikitext and triples must come from the same commit
+                        eq_(unicode(wikitext), ":count->%s" % count)
+        except Exception, ex:
+            self.errors.append(ex)
+
+    def test_stress(self):
+        done = []
+        writers = [ Thread(target=self.writer, args=(i,))
+                    for i in range(WRITERS) ]
+        readers = [ Thread(target=self.reader, args=(done,))
+                    for _ in range(2) ]
+        for thread in writers + readers:
+            thread.start()
+        for thread in writers:
+            thread.join()
+        done.append(True)
+        for thread in readers:
+            thread.join()
+
+        eq_(self.errors, [])
+        for i in range(WRITERS):
+            uri = URIRef(ROOT_URI + "Own%s" % i)
+            state = self.service.get(uri).get_state()
+            eq_(state.value(uri, COUNT).toPython(), EDITS)
+        total = 0
+        for i in range(SHARED):
+            uri = URIRef(ROOT_URI + "Shared%s" % i)
+            state = self.service.get(uri).get_state()
+            total += state.value(uri, COUNT).toPython()
+            eq_(self.service.get_revision(uri),
+                state.value(uri, COUNT).toPython())
+        eq_(total, WRITERS * EDITS) # no lost update
@@ -0,0 +1,109 @@
+from semwiki.export import export_html, MANIFEST, topic_path
+from semwiki.service import SemWikiService
+
+from nose.tools import eq_, raises
+from json import dump, load
+from os import stat
+from os.path import exists, join
+from rdflib import Graph, URIRef
+from rdfrest.local import unregister_service
+from shutil import rmtree
+from tempfile import mkdtemp
+
+ROOT_URI = URIRef("http://localhost:8001/")
+
+def test_topic_path():
+    eq_(topic_path("out", ROOT_URI, URIRef(ROOT_URI + "Foo"), "html"),
+        join("out", "Foo.html"))
+    eq_(topic_path("out", ROOT_URI, URIRef(ROOT_URI + "a/b"), "txt"),
+        join("out", "a", "b.txt"))
+
+@raises(ValueError)
+def test_topic_path_outside():
+    topic_path("out", ROOT_URI, URIRef(ROOT_URI + "a/../../b"), "txt")
+
+class TestExport():
+    def setUp(self):
+        self.service = SemWikiService(ROOT_URI, Graph().store, True)
+        self.output = mkdtemp()
+        self.edit("Alice", ":knows->:Bob *hello*")
+        self.edit("Bob", ":age->42")
+        self.edit("people/Carol", "see :Alice")
+
+    def tearDown(self):
+        unregister_service(self.service)
+        self.service = None
+        rmtree(self.output)
+
+    def edit(self, name, wikitext):
+        self.service.get(URIRef(ROOT_URI + name)).wikitext = wikitext
+
+    def path(self, name, ext):
+        return topic_path(self.output, ROOT_URI, URIRef(ROOT_URI + name), ext)
+
+    def test_export(self):
+        stats = export_html(self.service, self.output, processes=2)
+        eq_(stats, {"rendered": 3, "unchanged": 0, "removed": 0,
+                    "failed": 0})
+        assert exists(join(self.output, MANIFEST))
+        for name in ["Alice", "Bob", "people/Carol"]:
+            for ext in ["html", "txt", "ttl"]:
+                assert exists(self.path(name, ext)), (name, ext)
+        eq_(open(self.path("Bob", "txt")).read(), ":age->42")
+        assert "<em>hello</em>" in open(self.path("Alice", "html")).read()
+        assert "42" in open(self.path("Bob", "ttl")).read()
+
+    def test_static_html(self):
+        export_html(self.service, self.output, ["html", "txt"], processes=1)
+        alice = open(self.path("Alice", "html")).read()
+        assert "href='Bob.html'" in alice, alice
+        assert "href='knows.html'" in alice, alice
+        assert "href='Alice.txt'" in alice, alice
+        assert ".ttl" not in alice, alice
+        assert "PUT" not in alice, alice
+        carol = open(self.path("people/Carol", "html")).read()
+        assert "href='../Alice.html'" in carol, carol
+        assert "href='Carol.txt'" in carol, carol
+
+    def test_incremental(self):
+        export_html(self.service, self.output, processes=2)
+        mtime = stat(self.path("Alice", "html")).st_mtime
+        self.edit("Bob", ":age->43")
+        stats = export_html(self.service, self.output, processes=2)
+        eq_(stats, {"rendered": 1, "unchanged": 2, "removed": 0,
+                    "failed": 0})
+        eq_(open(self.path("Bob", "txt")).read(), ":age->43")
+        eq_(stat(self.path("Alice", "html")).st_mtime, mtime)
+
+        stats = export_html(self.service, self.output, processes=2,
+                            full=True)
+        eq_(stats["rendered"], 3)
+
+    def test_formats(self):
+        stats = export_html(self.service, self.output, ["txt"], processes=1)
+        eq_(stats["rendered"], 3)
+        assert not exists(self.path("Alice", "html"))
+        # changing formats invalidates the manifest
+        stats = export_html(self.service, self.output, ["txt", "html"],
+                            processes=1)
+        eq_(stats["rendered"], 3)
+        assert exists(self.path("Alice", "html"))
+
+    def test_removed_outside(self):
+        export_html(self.service, self.output, ["txt"], processes=1)
+        manifest_path = join(self.output, MANIFEST)
+        manifest = load(open(manifest_path))
+        manifest["topics"][ROOT_URI + "a/../../b"] = "x"
+        manifest["topics"]["http://example.org/Foo"] = "x"
+        dump(manifest, open(manifest_path, "w"))
+        stats = export_html(self.service, self.output, ["txt"], processes=1)
+        eq_(stats["removed"], 2)
+        assert exists(self.path("Bob", "txt"))
+
+    def test_no_index(self):
+        unregister_service(self.service)
+        self.service = SemWikiService(ROOT_URI, self.service.store, False,
+                                      index=False)
+        eq_(self.service.facets, None)
+        stats = export_html(self.service, self.output, ["txt"], processes=1)
+        eq_(stats["rendered"], 3)
@@ -0,0 +1,154 @@
+from semwiki.facets import FacetIndex, Facets, typed_key
+from semwiki.namespace import SW
+from semwiki.service import SemWikiService
+
+from datetime import date, datetime
+from decimal import Decimal
+from nose.tools import eq_, raises
+from rdflib import Graph, Literal, URIRef, XSD
+from rdfrest.exceptions import InvalidParametersError, MethodNotAllowedError
+from rdfrest.local import unregister_service
+
+ROOT_URI = URIRef("http://localhost:8001/")
+AGE = URIRef(ROOT_URI + "age")
+FACETS_URI = URIRef(ROOT_URI + "@facets")
+
+def test_typed_key():
+    for literal, expected in [
+        (Literal(42), ("number", 42)),
+        (Literal("4.5", datatype=XSD.decimal), ("number", Decimal("4.5"))),
+        (Literal("true", datatype=XSD.boolean), ("boolean", True)),
+        (Literal("maybe", datatype=XSD.boolean), (None, None)),
+        (Literal("abc", datatype=XSD.integer), (None, None)),
+        (Literal("2012-03-04", datatype=XSD.date),
+         ("date", date(2012, 3, 4))),
+        (Literal("2012-03-04T10:00:00+02:00", datatype=XSD.dateTime),
+         ("dateTime", datetime(2012, 3, 4, 8))),
+        (Literal("42"), (None, None)),
+        (URIRef("http://example.org/42"), (None, None)),
+        ]:
+        yield eq_, typed_key(literal), expected
+
+def test_index():
+    index = FacetIndex()
+    for i in range(10):
+        uri = URIRef("%sT%s" % (ROOT_URI, i))
+        index.update(uri, [(uri, AGE, Literal(i % 5))])
+    result = index.query(AGE, "number", 2, 3)
+    eq_(result["count"], 4)
+    eq_(result["distinct"], 2)
+    eq_(result["values"], [(2, 2), (3, 2)])
+    eq_(sorted(result["matches"]),
+        [ (URIRef("%sT%s" % (ROOT_URI, i)), i % 5) for i in [2, 3, 7, 8] ])
+    eq_(index.query(AGE, "number", 2, 3, limit=1)["values"], [(2, 2)])
+    eq_(index.query(AGE, "number", 10)["count"], 0)
+
+    # updates replace the previous values of the topic
+    uri = URIRef("%sT2" % ROOT_URI)
+    index.update(uri, [(uri, AGE, Literal(30))])
+    eq_(index.query(AGE, "number", 2, 3)["values"], [(2, 1), (3, 2)])
+    eq_(index.query(AGE, "number", 4)["values"], [(4, 2), (30, 1)])
+
+    # values are counted with multiplicity
+    index.update(uri, [(uri, AGE, Literal(30)), (uri, AGE, Literal(31))])
+    result = index.query(AGE, "number", 30)
+    eq_((result["count"], result["distinct"]), (2, 2))
+    eq_(result["values"], [(30, 1), (31, 1)])
+
+    # changes only touch the given triples
+    index.change(uri, [(uri, AGE, Literal(2))], [(uri, AGE, Literal(30))])
+    eq_(index.query(AGE, "number", 2, 3)["values"], [(2, 2), (3, 2)])
+    eq_(index.query(AGE, "number", 30)["values"], [(31, 1)])
+    index.change(uri, [], [(uri, AGE, Literal(2)), (uri, AGE, Literal(31))])
+    eq_(index.query(AGE, "number", 30)["count"], 0)
+    for i in range(10):
+        uri = URIRef("%sT%s" % (ROOT_URI, i))
+        index.update(uri, [])
+    eq_(index.get_facets(), [])
+
+
+class TestFacets():
+    def setUp(self):
+        self.service = SemWikiService(ROOT_URI, Graph().store, True)
+        self.edit("Alice", ":age->42 :born->true")
+        self.edit("Bob", ":age->17 :age->4.5e1")
+        self.edit("Carol", ":age->42 :name->\"Carol\"")
+
+    def tearDown(self):
+        unregister_service(self.service)
+        self.service = None
+
+    def edit(self, name, wikitext):
+        self.service.get(URIRef(ROOT_URI + name)).wikitext = wikitext
+
+    def get(self, **parameters):
+        facets = self.service.get(FACETS_URI)
+        assert isinstance(facets, Facets)
+        return facets.get_state(parameters or None)
+
+    def test_overview(self):
+        state = self.get()
+        facets = {}
+        for facet in state.objects(FACETS_URI, SW.facet):
+            facets[(state.value(facet, SW.predicate),
+                    unicode(state.value(facet, SW.kind)))] = \
+                state.value(facet, SW.count).toPython()
+        eq_(facets, {(AGE, "number"): 4,
+                     (URIRef(ROOT_URI + "born"), "boolean"): 1})
+
+    def test_range(self):
+        state = self.get(p=":age", min="40", max="44")
+        facet = state.value(FACETS_URI, SW.facet)
+        eq_(state.value(facet, SW.count).toPython(), 2)
+        eq_(state.value(facet, SW.distinct).toPython(), 1)
+        eq_(state.value(facet, SW.min).toPython(), 42)
+        topics = set( state.value(match, SW.topic)
+                      for match in state.objects(facet, SW.match) )
+        eq_(topics, set([URIRef(ROOT_URI + "Alice"),
+                         URIRef(ROOT_URI + "Carol")]))
+
+        state = self.get(p=unicode(AGE), min="18")
+        facet = state.value(FACETS_URI, SW.facet)
+        counts = dict( (state.value(value, SW.literal).toPython(),
+                        state.value(value, SW.count).toPython())
+                       for value in state.objects(facet, SW.value) )
+        eq_(counts, {42: 2, 45: 1})
+
+    def test_kept_current(self):
+        self.edit("Alice", ":age->43")
+        state = self.get(p=":age", min="42", max="42")
+        facet = state.value(FACETS_URI, SW.facet)
+        eq_(state.value(facet, SW.count).toPython(), 1)
+        eq_(len(self.get(p=":born")), 1) # only the rdf:type
+
+    def test_rdf_edit(self):
+        alice = URIRef(ROOT_URI + "Alice")
+        with self.service.get(alice).edit() as editable:
+            editable.remove((alice, AGE, Literal(42)))
+            editable.add((alice, AGE, Literal(12)))
+        state = self.get(p=":age", max="20")
+        facet = state.value(FACETS_URI, SW.facet)
+        eq_(state.value(facet, SW.count).toPython(), 2)
+        eq_(state.value(facet, SW.max).toPython(), 17)
+
+    def test_reload(self):
+        # the index is built from the store
+        store = self.service.store
+        unregister_service(self.service)
+        self.service = SemWikiService(ROOT_URI, store, False)
+        state = self.get(p=":age", min="42")
+        facet = state.value(FACETS_URI, SW.facet)
+        eq_(state.value(facet, SW.count).toPython(), 3)
+
+    @raises(InvalidParametersError)
+    def test_bad_parameter(self):
+        self.get(p=":age", foo="bar")
+
+    @raises(InvalidParametersError)
+    def test_bad_limit(self):
+        self.get(p=":age", limit="many")
+
+    @raises(MethodNotAllowedError)
+    def test_read_only(self):
+        with self.service.get(FACETS_URI).edit() as editable:
+            pass
@@ -1,7 +1,10 @@
 from nose.tools import eq_
-from rdflib import Graph, URIRef
+from rdflib import Graph, Literal, URIRef, XSD
+from rdfrest.local import unregister_service
 
-from semwiki.format import _SEM_MARKUP, wikitext_to_html
+from semwiki.format import _SEM_MARKUP, add_triples, ban_triples, \
+    wikitext_to_html, wikitext_to_triples
+from semwiki.namespace import SW
 from semwiki.service import SemWikiService
 
 _TEST_SEM_MARKUP = {
@@ -75,3 +78,78 @@ def test_wikitext_to_html():
     for text in _TEST_WIKITEXT_TO_HTML:
         yield check_wikitext_to_html, text
         
+
+class TestReconcile():
+    def setUp(self):
+        self.root = URIRef("http://localhost:8002/")
+        self.service = SemWikiService(self.root, Graph().store, True)
+        self.topic = self.service.get(self.uri("Alice"))
+
+    def tearDown(self):
+        unregister_service(self.service)
+        self.service = None
+
+    def uri(self, name):
+        return URIRef(self.root + name)
+
+    def triple(self, pred, obj):
+        return (self.topic.uri, self.uri(pred), obj)
+
+    def test_add_triples(self):
+        wikitext = add_triples(self.topic, "hello",
+                               [self.triple("knows", self.uri("Bob"))])
+        eq_(wikitext, "hello\n----# auto\n:knows->:Bob (auto)\n")
+        wikitext = add_triples(self.topic, wikitext,
+                               [self.triple("age", Literal(42))])
+        eq_(wikitext, "hello\n----# auto\n:knows->:Bob (auto)\n"
+                      ":age->42 (auto)\n")
+
+    def test_ban_triples(self):
+        wikitext = ("I :knows->:Bob and <%sknows>->:Dave and "
+                    ":age->42 # :knows->:Bob\n"
+                    "----# auto\n"
+                    ":knows->:Carol (auto)\n"
+                    ":name->\"Alice\" (auto)\n" % self.root)
+        banned = [ self.triple("knows", self.uri("Bob")),
+                   self.triple("knows", self.uri("Carol")),
+                   self.triple("knows", self.uri("Dave")),
+                   self.triple("age", Literal(42)),
+                   ]
+        new_wikitext = ban_triples(self.topic, wikitext, banned)
+        eq_(new_wikitext, "I :Bob and :Dave and 42 # :knows->:Bob\n"
+                          "----# auto\n"
+                          ":name->\"Alice\" (auto)\n"
+                          "\n# banned: :knows->:Bob"
+                          "\n# banned: :knows->:Carol"
+                          "\n# banned: :knows->:Dave"
+                          "\n# banned: :age->42")
+        eq_(set(wikitext_to_triples(self.topic, new_wikitext)),
+            set([self.triple("name", Literal("Alice"))]))
+        # banned comments are left untouched by subsequent bans
+        eq_(ban_triples(self.topic, new_wikitext, banned[:1]),
+            new_wikitext + "\n# banned: :knows->:Bob")
+
+    def test_ban_tagged_literals(self):
+        label = self.triple("label", Literal(u"\xe9t\xe9", lang="fr"))
+        date = self.triple("date", Literal("2012-03-04", datatype=XSD.date))
+        wikitext = add_triples(self.topic, u'I :label->"\xe9t\xe9"@fr !',
+                               [label, date])
+        eq_(ban_triples(self.topic, wikitext, [label, date]),
+            u'I "\xe9t\xe9"@fr !\n----# auto\n'
+            u'\n# banned: :label->"\xe9t\xe9"@fr'
+            u'\n# banned: :date->"2012-03-04"^^<%s>' % XSD.date)
+
+    def test_edit_triples(self):
+        self.topic.wikitext = "I :knows->:Bob\nand :age->42"
+        with self.topic.edit() as editable:
+            editable.remove(self.triple("knows", self.uri("Bob")))
+            editable.add(self.triple("knows", self.uri("Carol")))
+        eq_(self.topic.wikitext, "I :Bob\nand :age->42\n"
+                                 "----# auto\n:knows->:Carol (auto)\n"
+                                 "\n# banned: :knows->:Bob")
+        state = self.service.get(self.topic.uri).get_state()
+        eq_(set(state), set(self.topic.get_state()))
+        expected = wikitext_to_triples(self.topic, self.topic.wikitext)
+        expected.add((self.topic.uri, SW.wikitext,
+                      Literal(self.topic.wikitext)))
+        eq_(set(state), set(expected))
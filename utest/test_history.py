@@ -0,0 +1,100 @@
+from semwiki.history import diff_text, patch_text, RevisionStore
+from semwiki.service import SemWikiService
+from semwiki.namespace import SW
+
+from nose.tools import eq_, raises
+from rdflib import Graph, Literal, URIRef
+from rdflib.compare import isomorphic
+from rdfrest.exceptions import InvalidParametersError
+from rdfrest.local import unregister_service
+
+ROOT_URI = URIRef("http://localhost:8001/")
+TOPIC_URI = URIRef(ROOT_URI + "Topic")
+AGE = URIRef(ROOT_URI + "age")
+
+_TEST_DIFF = [
+    (u"", u"a\nb\n"),
+    (u"a\nb\n", u""),
+    (u"a\nb\nc", u"a\nB\nc\nd"),
+    (u"same\n", u"same\n"),
+    (u"no final newline", u"no final newline\n"),
+]
+
+def test_diff_patch():
+    def check_diff_patch(old, new):
+        eq_(patch_text(old, diff_text(old, new)), new)
+    for old, new in _TEST_DIFF:
+        yield check_diff_patch, old, new
+
+def make_state(i):
+    state = Graph(identifier=TOPIC_URI)
+    wikitext = u"".join( u"line %s\n" % j for j in range(i) )
+    state.add((TOPIC_URI, SW.wikitext, Literal(wikitext + u":age->%s" % i)))
+    state.add((TOPIC_URI, AGE, Literal(i)))
+    return state
+
+class TestRevisionStore():
+    def setUp(self):
+        self.history = RevisionStore(snapshot_interval=4)
+
+    def test_record_get(self):
+        states = [ make_state(i) for i in range(10) ]
+        for i, state in enumerate(states):
+            eq_(self.history.record(TOPIC_URI, state), i+1)
+        eq_(self.history.count(TOPIC_URI), 10)
+        for i, state in enumerate(states):
+            assert isomorphic(self.history.get(TOPIC_URI, i+1), state), i+1
+
+    def test_restart(self):
+        for i in range(6):
+            self.history.record(TOPIC_URI, make_state(i))
+        # simulates a persistent storage reopened after a restart
+        history = RevisionStore(self.history.storage, 4)
+        history.record(TOPIC_URI, make_state(6))
+        assert isomorphic(history.get(TOPIC_URI, 7), make_state(6))
+        assert isomorphic(history.get(TOPIC_URI, 2), make_state(1))
+
+    def test_deltas_are_small(self):
+        for i in range(8):
+            self.history.record(TOPIC_URI, make_state(100 + i))
+        key = str(TOPIC_URI)
+        snapshot = len(self.history.storage["%s 5" % key])
+        delta = len(self.history.storage["%s 6" % key])
+        assert delta < snapshot, (delta, snapshot)
+
+    @raises(KeyError)
+    def test_no_such_revision(self):
+        self.history.record(TOPIC_URI, make_state(0))
+        self.history.get(TOPIC_URI, 2)
+
+class TestTopicHistory():
+    def setUp(self):
+        self.service = SemWikiService(ROOT_URI, Graph().store, True,
+                                      history=RevisionStore())
+        self.topic = self.service.get(TOPIC_URI)
+
+    def tearDown(self):
+        unregister_service(self.service)
+        self.service = None
+
+    def test_rev_parameter(self):
+        self.topic.wikitext = ":age->1"
+        self.topic.wikitext = ":age->2"
+        old = self.topic.get_state({"rev": "1"})
+        eq_(old.value(TOPIC_URI, AGE), Literal(1))
+        eq_(unicode(old.value(TOPIC_URI, SW.wikitext)), u":age->1")
+        eq_(self.topic.get_state().value(TOPIC_URI, AGE), Literal(2))
+
+    @raises(InvalidParametersError)
+    def test_bad_rev(self):
+        self.topic.wikitext = ":age->1"
+        self.topic.get_state({"rev": "3"})
+
+    @raises(InvalidParametersError)
+    def test_bad_parameter(self):
+        self.topic.get_state({"foo": "1"})
+
+    @raises(InvalidParametersError)
+    def test_repeated_rev(self):
+        self.topic.wikitext = ":age->1"
+        self.topic.get_state({"rev": ["1", "1"]})
@@ -0,0 +1,121 @@
+from semwiki.hooks import HookRegistry, register_post_commit, \
+    register_pre_commit, unregister_hook
+from semwiki.namespace import SW
+from semwiki.service import SemWikiService
+
+from nose.tools import eq_, raises
+from rdflib import Graph, URIRef
+from rdfrest.exceptions import InvalidDataError
+from rdfrest.local import unregister_service
+from threading import Event
+
+ROOT_URI = URIRef("http://localhost:8001/")
+
+class TestHooks():
+    def setUp(self):
+        self.hooks = HookRegistry(workers=2, queue_size=4)
+        self.service = SemWikiService(ROOT_URI, Graph().store, True,
+                                      hooks=self.hooks)
+        self.calls = []
+
+    def tearDown(self):
+        unregister_service(self.service)
+        self.service = None
+
+    def edit(self, name, wikitext):
+        self.service.get(URIRef(ROOT_URI + name)).wikitext = wikitext
+
+    def wikitext(self, name):
+        return self.service.get(URIRef(ROOT_URI + name)).wikitext
+
+    def test_pre_commit_order(self):
+        @register_pre_commit(registry=self.hooks)
+        def second(topic, new_graph):
+            self.calls.append(("second", unicode(new_graph.value(topic.uri,
+                                                                 SW.wikitext))))
+        @register_pre_commit(priority=-1, registry=self.hooks)
+        def first(topic, new_graph):
+            self.calls.append(("first", self.wikitext("Home")))
+        self.edit("Home", "new")
+        # first is called before the commit
+        eq_(self.calls[0][0], "first")
+        assert self.calls[0][1] != "new"
+        eq_(self.calls[1], ("second", "new"))
+
+    @raises(InvalidDataError)
+    def test_pre_commit_veto(self):
+        @register_pre_commit(registry=self.hooks)
+        def veto(topic, new_graph):
+            raise InvalidDataError("vetoed")
+        try:
+            self.edit("Home", "new")
+        finally:
+            assert self.wikitext("Home") != "new"
+
+    @raises(InvalidDataError)
+    def test_pre_commit_error(self):
+        @register_pre_commit(registry=self.hooks)
+        def buggy(topic, new_graph):
+            raise ValueError("bug")
+        try:
+            self.edit("Home", "new")
+        finally:
+            assert self.wikitext("Home") != "new"
+
+    def test_post_commit(self):
+        @register_post_commit(priority=1, registry=self.hooks)
+        def second(event):
+            self.calls.append(("second", event.uri, event.revision))
+        @register_post_commit(registry=self.hooks)
+        def buggy(event):
+            raise ValueError("bug")
+        @register_post_commit(registry=self.hooks)
+        def first(event):
+            self.calls.append(("first", event.uri, event.revision,
+                               unicode(event.state.value(event.uri,
+                                                         SW.wikitext))))
+        self.edit("Foo", "one")
+        self.edit("Foo", "two")
+        self.hooks.flush()
+        foo = URIRef(ROOT_URI + "Foo")
+        eq_(self.calls, [("first", foo, 1, "one"), ("second", foo, 1),
+                         ("first", foo, 2, "two"), ("second", foo, 2)])
+        stats = self.hooks.get_stats()
+        eq_(stats["delivered"], 2)
+        eq_(stats["failed"], 2)
+
+        unregister_hook(first, self.hooks)
+        unregister_hook(second, self.hooks)
+        unregister_hook(buggy, self.hooks)
+        self.edit("Foo", "three")
+        eq_(self.hooks.get_stats()["dispatched"], 2)
+
+    def test_ordering(self):
+        seen = {}
+        @register_post_commit(registry=self.hooks)
+        def record(event):
+            seen.setdefault(event.uri, []).append(event.revision)
+        for i in range(4):
+            for name in ["A", "B", "C"]:
+                self.edit(name, "rev %s" % i)
+            self.hooks.flush()
+        for name in ["A", "B", "C"]:
+            eq_(seen[URIRef(ROOT_URI + name)], [1, 2, 3, 4])
+
+    def test_backpressure(self):
+        hooks = HookRegistry(workers=1, queue_size=2)
+        self.service.hooks = hooks
+        proceed = Event()
+        @register_post_commit(registry=hooks)
+        def slow(event):
+            proceed.wait()
+        for i in range(5):
+            # the edits are not delayed by the blocked hook
+            self.edit("Foo", "rev %s" % i)
+        proceed.set()
+        hooks.flush()
+        stats = hooks.get_stats()
+        # one event is being handled, two are queued, the others are dropped
+        eq_(stats["dispatched"] + stats["dropped"], 5)
+        assert stats["dropped"] >= 2, stats
+        eq_(stats["delivered"], stats["dispatched"])
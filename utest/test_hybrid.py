@@ -0,0 +1,85 @@
+from semwiki.hybrid import HybridStore
+from semwiki.service import SemWikiService
+
+from nose.tools import eq_
+from rdflib import Graph, Literal, URIRef
+from rdfrest.local import unregister_service
+
+ROOT_URI = URIRef("http://localhost:8001/")
+EX = "http://example.org/"
+
+def uri(name):
+    return URIRef(EX + name)
+
+class TestHybridStore():
+    def setUp(self):
+        self.cold = Graph().store
+        self.store = HybridStore(self.cold, budget=4)
+        self.graph = Graph(self.store, uri("g1"))
+        self.other = Graph(self.store, uri("g2"))
+
+    def test_read_write(self):
+        for i in range(3):
+            self.graph.add((uri("a"), uri("p"), Literal(i)))
+        self.other.add((uri("a"), uri("p"), Literal(0)))
+        eq_(len(list(self.graph.triples((uri("a"), None, None)))), 3)
+        eq_(self.store.get_stats()["misses"], 1)
+        # writes to a resident subject update the cache
+        self.graph.add((uri("a"), uri("q"), uri("b")))
+        eq_(set(self.graph.objects(uri("a"), uri("q"))), set([uri("b")]))
+        self.graph.remove((uri("a"), uri("p"), Literal(0)))
+        eq_(set(self.graph.objects(uri("a"), uri("p"))),
+            set([Literal(1), Literal(2)]))
+        eq_(set(self.other.objects(uri("a"), uri("p"))), set([Literal(0)]))
+        eq_(self.store.get_stats()["misses"], 1)
+        eq_(self.store.get_stats()["resident_triples"], 4)
+        # unbound subjects are answered by the underlying store
+        eq_(set(self.graph.subjects(uri("q"), uri("b"))), set([uri("a")]))
+        eq_(len(self.graph), 3)
+
+    def test_eviction(self):
+        for name in "abc":
+            for i in range(2):
+                self.graph.add((uri(name), uri("p"), Literal(i)))
+        for name in "abc":
+            eq_(len(list(self.graph.objects(uri(name), uri("p")))), 2)
+        stats = self.store.get_stats()
+        eq_(stats["resident_subjects"], 2)
+        eq_(stats["resident_triples"], 4)
+        eq_(stats["evictions"], 1)
+        # a is evicted, c is still resident
+        eq_(len(list(self.graph.objects(uri("c"), uri("p")))), 2)
+        eq_(len(list(self.graph.objects(uri("a"), uri("p")))), 2)
+        stats = self.store.get_stats()
+        eq_((stats["hits"], stats["misses"]), (1, 4))
+        eq_(stats["hit_rate"], 0.2)
+
+    def test_remove_all(self):
+        self.graph.add((uri("a"), uri("p"), Literal(0)))
+        list(self.graph.triples((uri("a"), None, None)))
+        self.graph.remove((None, None, None))
+        eq_(list(self.graph.triples((uri("a"), None, None))), [])
+        eq_(self.store.get_stats()["resident_triples"], 0)
+
+
+class TestHybridService():
+    def setUp(self):
+        self.store = HybridStore(Graph().store, budget=10)
+        self.service = SemWikiService(ROOT_URI, self.store, True)
+
+    def tearDown(self):
+        unregister_service(self.service)
+        self.service = None
+
+    def test_topics(self):
+        for i in range(20):
+            topic = self.service.get(URIRef("%sT%s" % (ROOT_URI, i)))
+            topic.wikitext = ":number->%s :next->:T%s" % (i, i + 1)
+        for i in range(20):
+            uri = URIRef("%sT%s" % (ROOT_URI, i))
+            state = self.service.get(uri).get_state()
+            eq_(state.value(uri, URIRef(ROOT_URI + "number")).toPython(), i)
+            eq_(len(state), 3)
+        stats = self.store.get_stats()
+        assert stats["resident_triples"] <= 10, stats
+        assert stats["evictions"] > 0, stats
@@ -0,0 +1,170 @@
+from semwiki.hooks import HookRegistry
+from semwiki.namespace import SW
+from semwiki.replication import apply_state, ChangeLog, ChangeLogPublisher, \
+    ReplicaFollower, ReplicaFrontend
+from semwiki.service import SemWikiService
+
+from nose.tools import eq_
+from rdflib import Graph, URIRef
+from rdfrest.http_server import HttpFrontend
+from rdfrest.local import unregister_service
+from threading import Thread
+from time import time
+from urllib2 import HTTPError, Request, urlopen
+from wsgiref.simple_server import make_server, WSGIRequestHandler
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+def serve(app_factory):
+    """Start a loopback server, and return it with its root URI."""
+    httpd = make_server("localhost", 0, None, handler_class=QuietHandler)
+    root_uri = URIRef("http://localhost:%s/" % httpd.server_port)
+    httpd.set_app(app_factory(root_uri))
+    thread = Thread(target=httpd.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return httpd, root_uri
+
+def test_changelog():
+    changelog = ChangeLog(maxlen=3)
+    eq_(changelog.since(0), [])
+    graph = Graph()
+    for i in range(5):
+        eq_(changelog.append(URIRef("http://localhost/T%s" % i), graph), i+1)
+    eq_(changelog.last, 5)
+    eq_([ i[0] for i in changelog.since(2) ], [3, 4, 5])
+    eq_([ i[0] for i in changelog.since(3, 1) ], [4])
+    assert changelog.since(1) is None # discarded
+    assert changelog.since(6) is None # in the future
+
+class TestReplication():
+    def setUp(self):
+        self.services = []
+        def make_primary(root_uri):
+            self.primary = SemWikiService(root_uri, Graph().store, True,
+                                          ChangeLog())
+            self.services.append(self.primary)
+            app = HttpFrontend(self.primary)
+            return ChangeLogPublisher(app, self.primary)
+        self.primary_httpd, self.primary_uri = serve(make_primary)
+
+        def make_replica(root_uri):
+            self.replica = SemWikiService(root_uri, Graph().store, True)
+            self.services.append(self.replica)
+            self.follower = ReplicaFollower(self.replica, self.primary_uri)
+            return ReplicaFrontend(HttpFrontend(self.replica), self.follower)
+        self.replica_httpd, self.replica_uri = serve(make_replica)
+
+    def tearDown(self):
+        for httpd in (self.primary_httpd, self.replica_httpd):
+            httpd.shutdown()
+            httpd.server_close()
+        for service in self.services:
+            unregister_service(service)
+
+    def edit(self, name, wikitext):
+        topic = self.primary.get(URIRef(self.primary_uri + name))
+        topic.wikitext = wikitext
+
+    def replica_wikitext(self, name):
+        return urlopen(self.replica_uri + name + ".txt").read()
+
+    def test_follow(self):
+        self.edit("Alice", ":knows->:Bob")
+        self.edit("Bob", ":age->42")
+        assert not self.follower.poll()
+        eq_(self.replica_wikitext("Bob"), ":age->42")
+        alice = self.replica.get(URIRef(self.replica_uri + "Alice"))
+        eq_(alice.get_state().value(alice.uri,
+                                    URIRef(self.replica_uri + "knows")),
+            URIRef(self.replica_uri + "Bob"))
+
+        self.edit("Bob", ":age->43")
+        assert not self.follower.poll()
+        eq_(self.replica_wikitext("Bob"), ":age->43")
+        status = self.follower.status()
+        eq_(status["applied"], 3)
+        eq_(status["lag_changes"], 0)
+
+    def test_initial_value(self):
+        # saving the initial value of a topic stores it, on both sides
+        topic = self.primary.get(URIRef(self.primary_uri + "Alice"))
+        topic.wikitext = topic.wikitext
+        self.follower.poll()
+        for service in (self.primary, self.replica):
+            uri = URIRef(service.root_uri + "Alice")
+            stored = Graph(service.store, service.root_uri)
+            eq_(unicode(stored.value(uri, SW.wikitext)), topic.wikitext)
+            eq_(service.links.get_report()["topics"], 1)
+
+    def test_lag(self):
+        self.follower.batch = 1
+        self.edit("Alice", "one")
+        self.follower.poll()
+        before = time()
+        self.edit("Alice", "two")
+        self.edit("Alice", "three")
+        after = time()
+        # the primary is only known as of the last poll
+        status = self.follower.status()
+        eq_((status["lag_changes"], status["lag_seconds"]), (0, 0.0))
+
+        assert self.follower.poll()
+        status = self.follower.status()
+        eq_(status["lag_changes"], 1)
+        # the oldest pending change is "three"
+        assert 0 <= status["lag_seconds"] <= time() - before, status
+        assert status["lag_seconds"] >= time() - after - 0.1, status
+        assert not self.follower.poll()
+        status = self.follower.status()
+        eq_((status["lag_changes"], status["lag_seconds"]), (0, 0.0))
+        eq_(self.replica_wikitext("Alice"), "three")
+
+    def test_resync(self):
+        self.edit("Alice", "first")
+        self.edit("Bob", "gone")
+        self.follower.poll()
+        events = []
+        hooks = HookRegistry()
+        hooks.add_post_commit(lambda event: events.append(event.uri))
+        self.replica.hooks = hooks
+        # simulates a restart of the primary, which lost topic Bob
+        self.primary.changelog = ChangeLog()
+        bob = URIRef(self.primary_uri + "Bob")
+        apply_state(self.primary, bob, Graph(identifier=bob))
+        self.edit("Alice", "second")
+        self.edit("Carol", "new")
+        self.follower.poll()
+        eq_(self.replica_wikitext("Alice"), "second")
+        eq_(self.replica_wikitext("Carol"), "new")
+        eq_(self.replica.links.get_report()["topics"], 2)
+        eq_(self.follower.epoch, self.primary.changelog.epoch)
+        hooks.flush()
+        # only the topics that actually changed were touched
+        eq_(sorted(events), [ URIRef(self.replica_uri + name)
+                              for name in ("Alice", "Bob", "Carol") ])
+        # an up to date replica is left untouched by a snapshot
+        del events[:]
+        self.follower.epoch = None
+        self.follower.poll()
+        hooks.flush()
+        eq_(events, [])
+
+    def test_reject_writes(self):
+        req = Request(self.replica_uri + "Alice", "hello",
+                      {"content-type": "text/plain"})
+        req.get_method = lambda: "PUT"
+        try:
+            urlopen(req)
+        except HTTPError, ex:
+            eq_(ex.code, 405)
+        else:
+            assert False, "PUT should have been rejected"
+
+    def test_status(self):
+        self.edit("Alice", "hello")
+        self.follower.poll()
+        resp = urlopen(self.replica_uri + "@replication")
+        eq_(resp.info()["x-replication-lag"], "0")
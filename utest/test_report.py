@@ -0,0 +1,130 @@
+from semwiki.namespace import SW
+from semwiki.replication import apply_state
+from semwiki.report import LinkReport, Report
+from semwiki.service import SemWikiService
+
+from nose.tools import eq_, raises
+from rdflib import Graph, URIRef, RDFS
+from rdfrest.exceptions import InvalidParametersError
+from rdfrest.local import unregister_service
+
+ROOT_URI = URIRef("http://localhost:8001/")
+REPORT_URI = URIRef(ROOT_URI + "@report")
+
+def uri(name):
+    return URIRef(ROOT_URI + name)
+
+def test_link_report():
+    report = LinkReport()
+    report.update(uri("A"), True, [uri("B"), uri("C"), uri("A")])
+    eq_(report.get_report()["topics"], 1)
+    eq_(set(report.get_report()["orphan_list"]), set([uri("A")]))
+    eq_(sorted(i[0] for i in report.get_report()["dangling_list"]),
+        [uri("B"), uri("C")])
+
+    report.update(uri("B"), True, [uri("A")])
+    result = report.get_report()
+    eq_(result["orphans"], 0)
+    eq_(result["dangling_list"], [(uri("C"), [uri("A")])])
+
+    report.update(uri("A"), True, [uri("C")])
+    eq_(report.get_report()["orphan_list"], [uri("B")])
+
+    report.update(uri("A"), False, [])
+    result = report.get_report()
+    eq_(result["dangling_list"], [(uri("A"), [uri("B")])])
+    eq_(result["orphan_list"], [uri("B")])
+    eq_(result["topics"], 1)
+
+    eq_(len(report.get_report(limit=0)["orphan_list"]), 0)
+
+def test_link_report_change():
+    report = LinkReport()
+    report.update(uri("A"), True, [uri("B"), uri("B")])
+    # B is still linked by A, once
+    report.change(uri("A"), True, [uri("C")], [uri("B")])
+    eq_(sorted(i[0] for i in report.get_report()["dangling_list"]),
+        [uri("B"), uri("C")])
+    report.change(uri("A"), True, [], [uri("B")])
+    eq_(report.get_report()["dangling_list"], [(uri("C"), [uri("A")])])
+    report.change(uri("A"), True, [uri("C")], [uri("C")])
+    eq_(report.get_report()["dangling_list"], [(uri("C"), [uri("A")])])
+    report.change(uri("A"), False, [], [uri("C")])
+    eq_(report.get_report(), {"topics": 0, "dangling": 0, "orphans": 0,
+                              "dangling_list": [], "orphan_list": []})
+
+class TestReport():
+    def setUp(self):
+        self.service = SemWikiService(ROOT_URI, Graph().store, True)
+        self.edit("Home", "Welcome, see :Alice and :Bob")
+        self.edit("Alice", ":knows->:Bob :age->42 # not a link :Nowhere")
+        self.edit("Bob", "see <%sCarol>" % ROOT_URI)
+        self.edit("Dave", "nobody links to me, see :Home")
+
+    def tearDown(self):
+        unregister_service(self.service)
+        self.service = None
+
+    def edit(self, name, wikitext):
+        self.service.get(uri(name)).wikitext = wikitext
+
+    def get(self, **parameters):
+        report = self.service.get(REPORT_URI)
+        assert isinstance(report, Report)
+        return report.get_state(parameters or None)
+
+    def check(self, topics, dangling, orphans):
+        state = self.get()
+        eq_(state.value(REPORT_URI, SW.topicCount).toPython(), topics)
+        found = {}
+        for node in state.objects(REPORT_URI, SW.dangling):
+            found[state.value(node, SW.topic)] = \
+                set(state.objects(node, SW.linkedFrom))
+        eq_(found, dangling)
+        eq_(set(state.objects(REPORT_URI, SW.orphan)), orphans)
+        eq_(state.value(REPORT_URI, SW.orphanCount).toPython(), len(orphans))
+
+    def test_report(self):
+        self.check(4, {uri("Carol"): set([uri("Bob")])}, set([uri("Dave")]))
+
+    def test_incremental(self):
+        self.edit("Carol", "here I am")
+        self.edit("Alice", "see :Dave")
+        self.check(5, {}, set())
+        # links given as triples count as well
+        with self.service.get(uri("Carol")).edit() as editable:
+            editable.add((uri("Carol"), RDFS.seeAlso, uri("Eve")))
+        self.check(5, {uri("Eve"): set([uri("Carol")])}, set())
+        # a removed topic becomes a dangling link
+        apply_state(self.service, uri("Dave"), ())
+        self.check(4, {uri("Eve"): set([uri("Carol")]),
+                       uri("Dave"): set([uri("Alice")])}, set())
+
+    def test_rdf_edit(self):
+        # the semantic link :knows->:Bob is both a triple and a link in the
+        # wikitext; removing the triple removes both
+        alice = uri("Alice")
+        with self.service.get(alice).edit() as editable:
+            editable.remove((alice, uri("knows"), uri("Bob")))
+            editable.add((alice, uri("knows"), uri("Eve")))
+        self.check(4, {uri("Carol"): set([uri("Bob")]),
+                       uri("Eve"): set([alice])}, set([uri("Dave")]))
+        with self.service.get(alice).edit() as editable:
+            editable.remove((alice, uri("knows"), uri("Eve")))
+        self.check(4, {uri("Carol"): set([uri("Bob")])}, set([uri("Dave")]))
+        self.test_reload()
+
+    def test_reload(self):
+        store = self.service.store
+        unregister_service(self.service)
+        self.service = SemWikiService(ROOT_URI, store, False)
+        self.check(4, {uri("Carol"): set([uri("Bob")])}, set([uri("Dave")]))
+
+    def test_limit(self):
+        state = self.get(limit="0")
+        eq_(state.value(REPORT_URI, SW.danglingCount).toPython(), 1)
+        eq_(list(state.objects(REPORT_URI, SW.dangling)), [])
+
+    @raises(InvalidParametersError)
+    def test_bad_parameter(self):
+        self.get(foo="bar")
@@ -27,6 +27,13 @@ class TestSemWiki():
     def test_get_new(self):
         assert isinstance(self.service.get(NEW_URI), Topic)
 
+    def test_save_initial_value(self):
+        page = self.service.get(NEW_URI)
+        page.wikitext = page.wikitext
+        stored = Graph(self.service.store, ROOT_URI)
+        assert stored.value(NEW_URI, SW.wikitext) is not None
+        assert (NEW_URI, SW.wikitext, Literal(page.wikitext)) in stored
+
     @raises(RdfRestException)
     def test_put_incoming(self):
         page = self.service.get(NEW_URI)
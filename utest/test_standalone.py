@@ -0,0 +1,271 @@
+from semwiki.service import SemWikiService
+from semwiki.standalone import accepts_gzip, AdmissionController, \
+    GzipCompressor, KeepAliveRequestHandler
+
+from gzip import GzipFile
+from httplib import HTTPConnection
+from nose.tools import eq_
+from rdflib import Graph, URIRef
+from rdfrest.local import unregister_service
+from errno import EPIPE
+from socket import create_connection, error as socket_error
+from SocketServer import ThreadingMixIn
+from StringIO import StringIO
+from json import loads
+from threading import Event, Thread
+from wsgiref import util as wsgiref_util
+from wsgiref.simple_server import make_server, WSGIServer
+
+ROOT_URI = URIRef("http://localhost:8001/")
+
+def test_accepts_gzip():
+    for header, expected in [
+        ("", False),
+        ("gzip", True),
+        ("deflate, gzip;q=0.5", True),
+        ("gzip;q=0", False),
+        ("*", True),
+        ("*;q=0", False),
+        ("identity", False),
+        ("x-gzip", True),
+        ]:
+        yield eq_, accepts_gzip(header), expected
+
+def gunzip(data):
+    return GzipFile(fileobj=StringIO(data)).read()
+
+class TestGzipCompressor():
+    def setUp(self):
+        self.service = SemWikiService(ROOT_URI, Graph().store, True)
+        self.serialized = 0
+        def app(env, start_response):
+            start_response("200 OK", [("content-type", "text/html")])
+            def body():
+                self.serialized += 1
+                yield "x" * 1000
+            return body()
+        self.app = GzipCompressor(app, self.service)
+
+    def tearDown(self):
+        unregister_service(self.service)
+        self.service = None
+
+    def get(self, path, accept_encoding="gzip"):
+        env = {"PATH_INFO": path, "HTTP_ACCEPT_ENCODING": accept_encoding}
+        wsgiref_util.setup_testing_defaults(env)
+        env["HTTP_HOST"] = "localhost:8001"
+        response = []
+        def start_response(status, headers, exc_info=None):
+            response[:] = [status, dict(headers)]
+        body = "".join(self.app(env, start_response))
+        return response[0], response[1], body
+
+    def test_compressed(self):
+        _, headers, body = self.get("/Home")
+        eq_(headers["content-encoding"], "gzip")
+        eq_(headers["vary"], "Accept-Encoding")
+        eq_(gunzip(body), "x" * 1000)
+
+    def test_not_accepted(self):
+        _, headers, body = self.get("/Home", "identity")
+        assert "content-encoding" not in headers
+        eq_(body, "x" * 1000)
+
+    def test_cache(self):
+        self.get("/Home")
+        _, headers, body = self.get("/Home")
+        eq_(self.serialized, 1) # second response did not need serialization
+        eq_(gunzip(body), "x" * 1000)
+        eq_(headers["content-length"], str(len(body)))
+
+        self.service.get(URIRef(ROOT_URI + "Home")).wikitext = "changed"
+        self.get("/Home")
+        eq_(self.serialized, 2) # new revision
+
+    def test_no_cache_for_non_topics(self):
+        self.get("/@foo")
+        self.get("/@foo")
+        eq_(self.serialized, 2)
+
+
+class TestAdmissionController():
+    def setUp(self):
+        self.proceed = Event()
+        def app(env, start_response):
+            self.proceed.wait()
+            start_response("200 OK", [("content-type", "text/plain")])
+            return ["done"]
+        self.app = AdmissionController(app, max_readers=1, max_writers=1,
+                                       queue_size=1, timeout=0.2)
+        self.statuses = []
+
+    def request(self, method="GET", path="/Home"):
+        env = {"PATH_INFO": path, "REQUEST_METHOD": method}
+        wsgiref_util.setup_testing_defaults(env)
+        response = []
+        def start_response(status, headers, exc_info=None):
+            response[:] = [status, dict(headers)]
+        result = self.app(env, start_response)
+        body = "".join(result)
+        getattr(result, "close", lambda: None)()
+        self.statuses.append(response[0][:3])
+        return response[0], response[1], body
+
+    def test_limits(self):
+        first = Thread(target=self.request)
+        first.start() # blocks in app
+        second = Thread(target=self.request)
+        second.start() # waits in queue, then times out
+        while self.app.readers.get_stats()["queue_depth"] == 0:
+            pass
+        status, headers, _ = self.request() # queue full
+        eq_(status[:3], "503")
+        eq_(headers["retry-after"], "1")
+        second.join()
+        eq_(self.statuses, ["503", "503"])
+
+        # writers have their own limit and queue
+        self.proceed.set()
+        status, _, _ = self.request("PUT")
+        eq_(status[:3], "200")
+        first.join()
+
+        _, _, body = self.request(path="/@admission")
+        stats = loads(body)
+        eq_(stats["read"]["rejected"], 1)
+        eq_(stats["read"]["timed_out"], 1)
+        eq_(stats["read"]["active"], 0)
+        eq_(stats["write"]["admitted"], 1)
+
+    def test_queue(self):
+        first = Thread(target=self.request)
+        first.start()
+        second = Thread(target=self.request)
+        second.start()
+        while self.app.readers.get_stats()["queue_depth"] == 0:
+            pass
+        self.proceed.set() # second gets the slot of the first
+        first.join()
+        second.join()
+        eq_(self.statuses, ["200", "200"])
+        stats = self.app.readers.get_stats()
+        eq_(stats["queued"], 1)
+        eq_(stats["active"], 0)
+
+
+class ThreadingServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+    connections = 0
+
+    def process_request(self, request, client_address):
+        self.connections += 1
+        ThreadingMixIn.process_request(self, request, client_address)
+
+class QuietKeepAliveHandler(KeepAliveRequestHandler):
+    def log_message(self, *args):
+        pass
+
+class TestKeepAlive():
+    def setUp(self):
+        def app(env, start_response):
+            path = env["PATH_INFO"]
+            if path == "/chunked":
+                start_response("200 OK", [("content-type", "text/plain")])
+                return iter(["hello ", "", "world"])
+            elif path == "/echo":
+                body = env["wsgi.input"].read(int(env["CONTENT_LENGTH"]))
+                start_response("200 OK", [("content-type", "text/plain")])
+                return [body]
+            elif path == "/unread":
+                start_response("204 No Content", [])
+                return []
+            start_response("200 OK", [("content-type", "text/plain")])
+            return ["fixed"]
+        self.httpd = make_server("localhost", 0, app, ThreadingServer,
+                                 QuietKeepAliveHandler)
+        self.httpd.keep_alive_timeout = 5
+        thread = Thread(target=self.httpd.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def tearDown(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def test_persistent(self):
+        conn = HTTPConnection("localhost", self.httpd.server_port)
+        for path, method, body, expected in [
+            ("/fixed", "GET", None, "fixed"),
+            ("/chunked", "GET", None, "hello world"),
+            ("/unread", "POST", "x" * 100, ""),
+            ("/echo", "PUT", "some data", "some data"),
+            ("/chunked", "HEAD", None, ""),
+            ("/fixed", "GET", None, "fixed"),
+            ]:
+            conn.request(method, path, body)
+            response = conn.getresponse()
+            eq_(response.read(), expected)
+            eq_(response.getheader("connection"), None)
+        conn.close()
+        eq_(self.httpd.connections, 1)
+
+    def test_pipelined(self):
+        sock = create_connection(("localhost", self.httpd.server_port))
+        sock.sendall("GET /chunked HTTP/1.1\r\nHost: x\r\n\r\n"
+                     "POST /echo HTTP/1.1\r\nHost: x\r\n"
+                     "Content-Length: 3\r\n\r\nabc"
+                     "GET /fixed HTTP/1.1\r\nHost: x\r\n"
+                     "Connection: close\r\n\r\n")
+        data = []
+        while True:
+            chunk = sock.recv(4096)
+            if not chunk:
+                break
+            data.append(chunk)
+        sock.close()
+        data = "".join(data)
+        responses = data.split("HTTP/1.1 200 OK\r\n")[1:]
+        eq_(len(responses), 3)
+        assert "Transfer-Encoding: chunked" in responses[0]
+        assert responses[0].endswith(
+            "\r\n\r\n6\r\nhello \r\n5\r\nworld\r\n0\r\n\r\n")
+        assert responses[1].endswith("\r\n\r\nabc")
+        assert "Connection: close" in responses[2]
+        assert responses[2].endswith("\r\n\r\nfixed")
+
+    def test_http10(self):
+        sock = create_connection(("localhost", self.httpd.server_port))
+        sock.sendall("GET /chunked HTTP/1.0\r\n"
+                     "Connection: keep-alive\r\n\r\n")
+        data = []
+        while True:
+            chunk = sock.recv(4096)
+            if not chunk:
+                break # no length can be given, so the server closes
+            data.append(chunk)
+        sock.close()
+        data = "".join(data)
+        assert "Transfer-Encoding" not in data
+        assert data.endswith("\r\n\r\nhello world")
+
+class BrokenPipe(StringIO):
+    def flush(self):
+        raise socket_error(EPIPE, "Broken pipe")
+
+def test_keep_alive_broken_pipe():
+    class Handler(QuietKeepAliveHandler):
+        def __init__(self):
+            # not connected to any socket
+            self.rfile = StringIO("GET / HTTP/1.1\r\nHost: x\r\n\r\n")
+            self.wfile = BrokenPipe()
+            self.close_connection = 0
+        def _serve_request(self):
+            raise ValueError("application error")
+    handler = Handler()
+    try:
+        handler.handle_one_request()
+    except ValueError:
+        pass
+    else:
+        assert False, "the error of the application was masked"
+    eq_(handler.close_connection, 1)